@@ -0,0 +1,44 @@
+import gzip
+
+from yearmaps.impl.assets import AssetStore, Asset, accepted_encodings, write_variants
+
+
+def test_load_and_match(tmp_path):
+    store = AssetStore()
+    path = tmp_path / "a.png"
+    assert store.load("a", path) is None
+    path.write_bytes(b"png")
+    asset = store.load("a", path)
+    assert store.get("a") is asset
+    assert asset.media_type == "image/png"
+    assert not asset.variants
+    assert Asset.matches(asset.etag, asset.etag)
+    assert Asset.matches(f'"other", W/{asset.etag}', asset.etag)
+    assert not Asset.matches('"other"', asset.etag)
+    assert not Asset.matches(None, asset.etag)
+
+    # Unchanged content keeps the asset, new content changes the etag
+    assert store.load("a", path) is asset
+    path.write_bytes(b"png2")
+    assert store.load("a", path).etag != asset.etag
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("gzip, deflate, br") == {"gzip", "deflate", "br"}
+    assert accepted_encodings("gzip;q=0, br;q=0.5") == {"br"}
+    assert accepted_encodings(None) == set()
+    assert accepted_encodings("gzip;q=0, *") == {"*", "br"}
+    assert accepted_encodings("br;q=0,*;q=1") == {"*", "gzip"}
+
+
+def test_svg_variants(tmp_path):
+    path = tmp_path / "a.svg"
+    path.write_text("<svg>" + "<rect/>" * 100 + "</svg>")
+    write_variants(path)
+    assert gzip.decompress((tmp_path / "a.svg.gz").read_bytes()) == path.read_bytes()
+
+    asset = AssetStore().load("a", path)
+    encoding, body, etag = asset.select("gzip")
+    assert encoding == "gzip" and gzip.decompress(body) == asset.body
+    assert etag != asset.etag
+    assert asset.select("identity") == (None, asset.body, asset.etag)
@@ -0,0 +1,63 @@
+from datetime import date
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from yearmaps.constant import Configs
+from yearmaps.impl.task import build_tasks
+from yearmaps.script import cli, output_names
+from yearmaps.utils import http
+from tests.test_codeforces import FakeApi, cf
+
+
+def context(tmp_path) -> click.Context:
+    return click.Context(cli, obj=Configs(data_dir=str(tmp_path), output=str(tmp_path), mode='till_now',
+                                          file_type='svg'))
+
+
+def test_build_tasks(tmp_path):
+    tasks = build_tasks(context(tmp_path), {
+        'cf': [{'user': 'tourist', 'refresh': 60}, {'user': 'petr', 'global': {'color': 'red'}}],
+        'bili': {'id': '1', 'c': 2},
+    })
+    assert [task.command_options for task in tasks] == [{'user': 'tourist'}, {'user': 'petr'},
+                                                        {'uid': '1', 'concurrency': 2}]
+    assert tasks[0].interval == 60
+    assert [task.global_config.color for task in tasks] == [None, 'red', None]
+    assert len({task.task_hash() for task in tasks}) == 3
+
+
+def test_build_tasks_rejects(tmp_path):
+    with pytest.raises(KeyError):
+        build_tasks(context(tmp_path), {'nope': {}})
+    with pytest.raises(KeyError):
+        build_tasks(context(tmp_path), {'cf': [{'user': 'tourist'}, {'gtype': 'ac'}]})
+    with pytest.raises(ValueError):
+        build_tasks(context(tmp_path), {'cf': {'user': 'tourist', 'global': {'mode': 'never'}}})
+
+
+def test_output_names(tmp_path):
+    tasks = build_tasks(context(tmp_path), {
+        'cf': [{'user': 'tourist'}, {'user': 'tourist', 'type': 'ac'}, {'user': 'a/b'}],
+    })
+    names = output_names(tasks)
+    assert names[2] == 'cf-a_b.svg'
+    # The same user twice is told apart by the task hash
+    assert names[0].startswith('cf-tourist-') and names[1].startswith('cf-tourist-')
+    assert len(set(names)) == 3
+
+
+def test_batch(monkeypatch, tmp_path):
+    api = FakeApi(100)
+    api.submit(date.today(), "OK")
+    monkeypatch.setattr(http, "session", lambda: api)
+    monkeypatch.setattr(cf.CodeforcesProvider, "http_ttl", None)
+    manifest = tmp_path / "manifest.yml"
+    manifest.write_text("cf:\n  - user: tourist\n  - user: petr\n", encoding='UTF-8')
+
+    result = CliRunner().invoke(cli, ['-d', str(tmp_path / "data"), '-o', str(tmp_path),
+                                      'batch', str(manifest), '-j', '2'])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "cf-tourist.svg").exists()
+    assert (tmp_path / "cf-petr.svg").exists()
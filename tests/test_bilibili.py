@@ -0,0 +1,121 @@
+import importlib
+import json
+from datetime import date
+from urllib.parse import urlparse, parse_qs
+
+from yearmaps.constant import Configs
+from yearmaps.utils import http
+
+# The package exports the class under the module name
+bili = importlib.import_module("yearmaps.provider.BilibiliProvider")
+
+DAY = 86400
+START = 1640995200  # 2022-01-01
+
+
+class FakeResponse:
+    def __init__(self, body, status_code=200, url=""):
+        self.body = body
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.reason = "Fake"
+        self.url = url
+        self.headers = {}
+        self.content = json.dumps(body).encode()
+
+    def json(self):
+        return self.body
+
+
+class FakeApi:
+    def __init__(self, count):
+        # Newest first, like the api, one video a day
+        self.created = [START + i * DAY for i in reversed(range(count))]
+        self.requested = []
+        self.throttle_once = set()
+
+    def upload(self, count):
+        newest = self.created[0]
+        self.created = [newest + i * DAY for i in reversed(range(1, count + 1))] + self.created
+
+    def request(self, _method, url, **_kwargs):
+        pn = int(parse_qs(urlparse(url).query)["pn"][0])
+        self.requested.append(pn)
+        if pn in self.throttle_once:
+            self.throttle_once.remove(pn)
+            return FakeResponse({"code": -412, "message": "请求被拦截"}, url=url)
+        videos = [{"created": created} for created in self.created[(pn - 1) * 50:pn * 50]]
+        return FakeResponse({"code": 0, "data": {"page": {"ps": 50, "count": len(self.created), "pn": pn},
+                                                 "list": {"vlist": videos}}}, url=url)
+
+
+def collect(tmp_path):
+    provider = bili.BilibiliVideoProvider("1")
+    provider.options = Configs(data_dir=str(tmp_path), output='', mode='till_now', file_type='svg')
+    return provider.process(provider.access())
+
+
+def test_fetch_exact_pages(monkeypatch, tmp_path):
+    api = FakeApi(120)
+    monkeypatch.setattr(http, "session", lambda: api)
+    monkeypatch.setattr(bili.BilibiliProvider, "http_ttl", None)
+    data = collect(tmp_path)
+    assert sum(data.values()) == 120
+    assert sorted(api.requested) == [1, 2, 3]
+
+
+def test_retry_when_throttled(monkeypatch, tmp_path):
+    api = FakeApi(120)
+    api.throttle_once.add(2)
+    monkeypatch.setattr(http, "session", lambda: api)
+    monkeypatch.setattr(bili.BilibiliProvider, "http_ttl", None)
+    monkeypatch.setattr(bili, "BACKOFF", 0)
+    assert sum(collect(tmp_path).values()) == 120
+    assert sorted(api.requested) == [1, 2, 2, 3]
+
+
+def test_throttled_response_not_cached(monkeypatch, tmp_path):
+    api = FakeApi(120)
+    api.throttle_once.update({1, 2})
+    monkeypatch.setattr(http, "session", lambda: api)
+    monkeypatch.setattr(bili, "BACKOFF", 0)
+    assert sum(collect(tmp_path).values()) == 120
+    # Retries reach upstream instead of replaying the throttled body
+    assert sorted(api.requested) == [1, 1, 2, 2, 3]
+
+    # Pages holding data are cached
+    api.requested.clear()
+    collect(tmp_path)
+    assert not api.requested
+
+
+def test_incremental_fetch(monkeypatch, tmp_path):
+    api = FakeApi(120)
+    monkeypatch.setattr(http, "session", lambda: api)
+    monkeypatch.setattr(bili.BilibiliProvider, "http_ttl", None)
+    collect(tmp_path)
+
+    api.requested.clear()
+    api.upload(3)
+    data = collect(tmp_path)
+    assert api.requested == [1]
+    assert sum(data.values()) == 123
+    assert data[date.fromtimestamp(api.created[0])] == 1
+
+    # New videos spanning several pages
+    api.requested.clear()
+    api.upload(70)
+    assert sum(collect(tmp_path).values()) == 193
+    assert sorted(api.requested) == [1, 2]
+
+    # Deleted videos can not be placed, so everything is counted again
+    api.requested.clear()
+    api.created = api.created[:-10]
+    assert sum(collect(tmp_path).values()) == 183
+    assert sorted(api.requested) == [1, 2, 3, 4]
+
+
+def test_throttling_left_to_provider():
+    retry = http.Session().get_adapter(bili.ENDPOINT_URL.format(uid="1", pn=1)).max_retries
+    assert not retry.is_retry('GET', 429)
+    assert retry.is_retry('GET', 503)
@@ -0,0 +1,72 @@
+from datetime import date
+
+import requests
+
+from yearmaps.utils import cache as cache_module
+from yearmaps.utils.cache import RenderCache, ResponseCache, TaskManifest, data_hash
+
+
+def test_data_hash_ignores_order():
+    a = {date(2022, 1, 1): 1, date(2022, 1, 2): 2}
+    b = {date(2022, 1, 2): 2, date(2022, 1, 1): 1}
+    assert data_hash(a) == data_hash(b)
+    assert data_hash(a) != data_hash({date(2022, 1, 1): 1, date(2022, 1, 2): 3})
+
+
+def test_render_cache(tmp_path):
+    cache = RenderCache(tmp_path / "data")
+    output = tmp_path / "out.svg"
+    assert not cache.is_fresh(output, "key")
+    cache.store(output, "key")
+    # The output itself must exist as well
+    assert not cache.is_fresh(output, "key")
+    output.write_text("<svg/>")
+    assert cache.is_fresh(output, "key")
+    assert not cache.is_fresh(output, "other")
+
+
+class FakeSession:
+    def __init__(self):
+        self.sent = []
+
+    def request(self, _method, url, headers=None, **_kwargs):
+        self.sent.append(headers)
+        resp = requests.Response()
+        resp.url = url
+        if headers.get('If-None-Match') == '"v1"':
+            resp.status_code = 304
+            resp._content = b''  # pylint: disable=protected-access
+        else:
+            resp.status_code = 200
+            resp.headers.update({'ETag': '"v1"', 'Content-Type': 'application/json; charset=utf-8'})
+            resp._content = b'{"ok": true}'  # pylint: disable=protected-access
+        return resp
+
+
+def test_task_manifest(tmp_path, monkeypatch):
+    output = tmp_path / "task.svg"
+    TaskManifest(tmp_path).record("task", "digest")
+    # Needs the output as well
+    assert not TaskManifest(tmp_path).is_done("task", output)
+    output.write_text("<svg/>")
+    assert TaskManifest(tmp_path).is_done("task", output)
+    assert not TaskManifest(tmp_path).is_done("other", output)
+    assert TaskManifest(tmp_path).load()["task"]["data"] == "digest"
+    monkeypatch.setattr(cache_module, "RENDER_VERSION", "next")
+    assert not TaskManifest(tmp_path).is_done("task", output)
+
+
+def test_response_cache(tmp_path):
+    cache = ResponseCache(tmp_path)
+    session = FakeSession()
+    assert cache.request(session, 'GET', 'https://example.com', ttl=60).json() == {'ok': True}
+    # Fresh within the ttl, upstream is not asked
+    assert cache.request(session, 'GET', 'https://example.com', ttl=60).json() == {'ok': True}
+    assert len(session.sent) == 1
+    # Stale, revalidated with the etag and replayed on 304
+    resp = cache.request(session, 'GET', 'https://example.com', ttl=0)
+    assert resp.status_code == 200 and resp.json() == {'ok': True}
+    assert session.sent[-1] == {'If-None-Match': '"v1"'}
+    # Other requests do not share the entry
+    cache.request(session, 'GET', 'https://example.com', ttl=60, params={'page': 2})
+    assert len(session.sent) == 3
@@ -0,0 +1,75 @@
+import importlib
+from datetime import date, datetime, timedelta
+
+from yearmaps.constant import Configs
+from yearmaps.utils import http
+
+# The package exports the class under the module name
+cf = importlib.import_module("yearmaps.provider.CodeforcesProvider")
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakeApi:
+    def __init__(self, days):
+        # One submission a day up to today, newest first, every third accepted
+        today = date.today()
+        self.submissions = []
+        for i in range(days):
+            self.submit(today - timedelta(days=days - 1 - i), "OK" if i % 3 == 0 else "WRONG_ANSWER")
+        self.requested = []
+
+    def submit(self, day, verdict):
+        created = int(datetime.combine(day, datetime.min.time()).timestamp()) + 3600
+        submission = {"id": len(self.submissions) + 1, "creationTimeSeconds": created}
+        if verdict is not None:
+            submission["verdict"] = verdict
+        self.submissions.insert(0, submission)
+        return submission
+
+    def request(self, _method, _url, params=None, **_kwargs):
+        start, count = params["from"], params["count"]
+        self.requested.append((start, count))
+        return FakeResponse({"status": "OK", "result": self.submissions[start - 1:start - 1 + count]})
+
+
+def collect(tmp_path, gtype="all"):
+    provider = cf.CodeforcesProvider.create("tourist", gtype)
+    provider.options = Configs(data_dir=str(tmp_path), output='', mode='till_now', file_type='svg')
+    return provider.process(provider.access())
+
+
+def test_window_stops_past_start_date(monkeypatch, tmp_path):
+    api = FakeApi(2000)
+    monkeypatch.setattr(http, "session", lambda: api)
+    monkeypatch.setattr(cf.CodeforcesProvider, "http_ttl", None)
+    data = collect(tmp_path)
+    # Pages of 50, 100, 200 and 400 reach back past 366 days
+    assert len(api.requested) == 4
+    assert data[date.today()] == 1
+    assert sum(data[date.today() - timedelta(days=i)] for i in range(367)) == 367
+
+
+def test_incremental_fetch(monkeypatch, tmp_path):
+    api = FakeApi(500)
+    monkeypatch.setattr(http, "session", lambda: api)
+    monkeypatch.setattr(cf.CodeforcesProvider, "http_ttl", None)
+    collect(tmp_path)
+
+    api.requested.clear()
+    api.submit(date.today(), "OK")
+    pending = api.submit(date.today(), "TESTING")
+    assert collect(tmp_path, "ac")[date.today()] == 1
+    assert api.requested == [(1, 50)]
+    assert collect(tmp_path, "all")[date.today()] == 2
+
+    # The judged submission is counted once it is final
+    pending["verdict"] = "OK"
+    assert collect(tmp_path, "ac")[date.today()] == 2
+    assert collect(tmp_path, "all")[date.today()] == 3
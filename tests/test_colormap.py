@@ -0,0 +1,33 @@
+import numpy as np
+
+from yearmaps.utils.colormap import PolarisationColorMap, WithBlankListedColorMap
+from yearmaps.utils.colors import blue
+from yearmaps.utils.palette import NO_VALUE_COLOR, hex_to_rgba
+
+
+def test_polarisation_masks():
+    values = np.ma.masked_invalid(np.array([[0.0, 0.5, np.nan], [1.0, np.nan, 0.0]]))
+    padding = np.array([[False, False, False], [False, True, False]])
+    zero = np.array([[True, False, False], [False, False, True]])
+    c_map = PolarisationColorMap(blue, -1, padding, zero)
+    color = c_map(values)
+    assert color.shape == (2, 3, 4)
+    assert np.allclose(color[0, 0], hex_to_rgba(blue[0]))
+    assert np.allclose(color[1, 2], hex_to_rgba(blue[0]))
+    assert np.allclose(color[0, 2], hex_to_rgba(NO_VALUE_COLOR))
+    assert np.allclose(color[1, 1], 0)
+    assert np.allclose(color[1, 0], hex_to_rgba(blue[-1]))
+
+
+def test_with_blank_color_need():
+    padding = np.zeros(3, dtype=bool)
+    c_map = WithBlankListedColorMap(blue, 3, padding)
+    assert c_map.N == 3
+    color = c_map(np.ma.masked_invalid(np.array([0.0, 0.5, 1.0])))
+    assert [tuple(c) for c in color] == [tuple(hex_to_rgba(c)) for c in blue[:3]]
+
+
+def test_color_bar_values_ignore_grid_masks():
+    c_map = WithBlankListedColorMap(blue, -1, np.ones(4, dtype=bool))
+    color = c_map(np.linspace(0, 1, 10))
+    assert (color[:, 3] == 1).all()
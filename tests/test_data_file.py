@@ -0,0 +1,78 @@
+import json
+import stat
+import threading
+
+from yearmaps.constant import Configs
+from yearmaps.utils.file import UMASK, atomic_write
+from tests.test_render import DummyProvider
+
+
+class UserProvider(DummyProvider):
+    def __init__(self, user):
+        self.user = user
+
+    @property
+    def identity(self):
+        return self.user
+
+
+def provider(tmp_path, user):
+    ret = UserProvider(user)
+    ret.options = Configs(data_dir=str(tmp_path), output='', mode='till_now', file_type='svg')
+    return ret
+
+
+def test_files_per_user(tmp_path):
+    (tmp_path / "dummy.json").write_text(json.dumps({"legacy": True}))
+    with provider(tmp_path, "a").data_file() as data:
+        # Read from the file of earlier versions until the user has its own
+        assert data == {"legacy": True}
+        data["user"] = "a"
+    with provider(tmp_path, "b").data_file() as data:
+        data["user"] = "b"
+    with provider(tmp_path, "a").data_file() as data:
+        assert data == {"legacy": True, "user": "a"}
+    assert provider(tmp_path, "a").data_file_path() != provider(tmp_path, "b").data_file_path()
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_concurrent_updates(tmp_path):
+    def increase():
+        for _ in range(20):
+            with provider(tmp_path, "a").data_file() as data:
+                data["count"] = data.get("count", 0) + 1
+
+    threads = [threading.Thread(target=increase) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with provider(tmp_path, "a").data_file() as data:
+        assert data["count"] == 80
+
+
+def test_failed_update_is_not_written(tmp_path):
+    with provider(tmp_path, "a").data_file() as data:
+        data["count"] = 1
+    try:
+        with provider(tmp_path, "a").data_file() as data:
+            data["count"] = 2
+            raise ConnectionError()
+    except ConnectionError:
+        pass
+    with provider(tmp_path, "a").data_file() as data:
+        assert data["count"] == 1
+
+
+def test_write_modes(tmp_path):
+    output = tmp_path / "out.svg"
+    atomic_write(output, "a")
+    assert stat.S_IMODE(output.stat().st_mode) == 0o666 & ~UMASK
+    # A replaced file keeps its mode
+    output.chmod(0o640)
+    atomic_write(output, "b")
+    assert stat.S_IMODE(output.stat().st_mode) == 0o640
+    # Data files may hold tokens
+    with provider(tmp_path, "a").data_file() as data:
+        data["token"] = "secret"
+    assert stat.S_IMODE(provider(tmp_path, "a").data_file_path().stat().st_mode) == 0o600
@@ -0,0 +1,47 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+from yearmaps.utils.grid import build_grid
+
+
+def test_grid_shape_and_padding():
+    # 2022-01-01 is a Saturday, 2022-12-31 is a Saturday
+    grid = build_grid({}, date(2022, 1, 1), date(2022, 12, 31))
+    assert grid.values.shape == (7, 53)
+    assert np.isnan(grid.values).all()
+    # Monday to Friday of the first week and the last Sunday are padding
+    assert grid.padding[:5, 0].all()
+    assert not grid.padding[5:, 0].any()
+    assert grid.padding[6, -1]
+    assert grid.padding.sum() == 6
+
+
+def test_grid_values_outside_range_are_dropped():
+    start, end = date(2022, 1, 1), date(2022, 12, 31)
+    data = {
+        date(2021, 12, 31): 1,
+        date(2022, 1, 3): 2,  # Monday of the second week
+        date(2022, 12, 31): 3,
+        date(2023, 1, 1): 4,
+    }
+    grid = build_grid(data, start, end)
+    assert grid.values[0, 1] == 2
+    assert grid.values[5, 52] == 3
+    assert np.nansum(grid.values) == 5
+
+
+def test_grid_months_and_year_label():
+    start = date(2021, 6, 14)
+    grid = build_grid({}, start, start + timedelta(days=366))
+    assert grid.months[0] == 6
+    assert grid.months[-1] == 6
+    assert set(grid.months) == set(range(1, 13))
+    # First Sunday of 2022 is 2022-01-02, in the 29th week of the graph
+    assert (grid.year, grid.year_loc) == (2022, 28)
+
+
+def test_grid_single_year_label():
+    grid = build_grid({}, date(2022, 1, 3), date(2022, 12, 25))
+    assert (grid.year, grid.year_loc) == (2022, 0)
+    assert not grid.padding.any()
@@ -0,0 +1,56 @@
+from requests import Response
+from requests.adapters import HTTPAdapter
+
+from yearmaps.utils import http
+
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(kwargs)
+        resp = Response()
+        resp.status_code = 200
+        resp.request = request
+        return resp
+
+
+def test_default_timeout():
+    session = http.Session(timeout=5)
+    adapter = RecordingAdapter()
+    session.mount('https://', adapter)
+    session.get('https://example.com')
+    session.get('https://example.com', timeout=1)
+    assert [kwargs['timeout'] for kwargs in adapter.sent] == [5, 1]
+
+
+def test_shared_session():
+    assert http.session() is http.session()
+    old = http.session()
+    http.configure(timeout=3)
+    try:
+        assert http.session() is not old
+        assert http.session().timeout == 3
+    finally:
+        http.configure(timeout=http.DEFAULT_TIMEOUT)
+
+
+def test_retries():
+    session = http.Session()
+    retry = session.get_adapter('https://example.com').max_retries
+    # Logins must not be sent twice
+    assert not retry.is_retry('POST', 503)
+    assert retry.is_retry('GET', 429)
+
+
+
+def test_retry_policy(monkeypatch):
+    monkeypatch.setattr(http, "_policies", {})
+    session = http.Session()
+    http.retry_policy('https://throttled.example.com/', status_forcelist=(503,))
+    retry = session.get_adapter('https://throttled.example.com/api').max_retries
+    assert not retry.is_retry('GET', 429)
+    assert retry.is_retry('GET', 503)
+    assert session.get_adapter('https://example.com').max_retries.is_retry('GET', 429)
@@ -0,0 +1,60 @@
+import pytest
+
+from yearmaps.impl.scheduler import Refresher
+from yearmaps.utils.metrics import (CACHE_REQUESTS, FETCH_FAILURES, RENDER_DURATION, Counter, Gauge, Histogram,
+                                    Registry)
+from tests.test_scheduler import BrokenProvider, SlowProvider, fake_task
+
+
+def value(metric, name=None, **labels) -> float:
+    for sample_name, sample_labels, sample_value in metric.samples():
+        if sample_name == (name or metric.name) and sample_labels == labels:
+            return sample_value
+    return 0
+
+
+def test_counter_exposition():
+    registry = Registry()
+    counter = registry.register(Counter('things_total', 'Things seen.', ['kind']))
+    counter.inc(kind='a')
+    counter.inc(2, kind='b\n"c"')
+    assert registry.exposition() == ('# HELP things_total Things seen.\n'
+                                     '# TYPE things_total counter\n'
+                                     'things_total{kind="a"} 1\n'
+                                     'things_total{kind="b\\n\\"c\\""} 2\n')
+    with pytest.raises(ValueError):
+        counter.inc(other='a')
+
+
+def test_histogram_is_cumulative():
+    histogram = Histogram('took_seconds', 'Time taken.', buckets=(0.1, 1))
+    for sample in (0.05, 0.1, 0.5, 3):
+        histogram.observe(sample)
+    assert [value(histogram, 'took_seconds_bucket', le=le) for le in ('0.1', '1', '+Inf')] == [2, 3, 4]
+    assert value(histogram, 'took_seconds_sum') == pytest.approx(3.65)
+    assert value(histogram, 'took_seconds_count') == 4
+
+
+def test_gauge_reads_function():
+    depth = [3]
+    gauge = Gauge('depth', 'Depth.', function=lambda: {(): depth[0]})
+    assert gauge.exposition().endswith('\ndepth 3')
+    depth[0] = 0
+    assert gauge.exposition().endswith('\ndepth 0')
+
+
+def test_refresh_records(tmp_path):
+    good = fake_task("good", SlowProvider(), tmp_path / "good.svg")
+    broken = fake_task("broken", BrokenProvider(), tmp_path / "broken.svg")
+    failures = value(FETCH_FAILURES, provider="broken")
+    renders = value(RENDER_DURATION, RENDER_DURATION.name + '_count', provider="good")
+    hits = value(CACHE_REQUESTS, cache='render', result='hit')
+
+    refresher = Refresher()
+    refresher.refresh([good, broken], quiet=True)
+    assert value(FETCH_FAILURES, provider="broken") == failures + 1
+    assert value(RENDER_DURATION, RENDER_DURATION.name + '_count', provider="good") == renders + 1
+
+    # The image is up to date, the second refresh does not draw it again
+    refresher.refresh([good], quiet=True)
+    assert value(CACHE_REQUESTS, cache='render', result='hit') == hits + 1
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from yearmaps.impl.assets import Asset
+from yearmaps.impl.ondemand import AssetCache, OnDemandRenderer
+from yearmaps.utils.flight import SingleFlight
+from tests.test_render import DummyProvider
+from tests.test_scheduler import fake_task
+
+
+class CountingProvider(DummyProvider):
+    def __init__(self):
+        self.accessed = 0
+
+    def access(self):
+        self.accessed += 1
+        time.sleep(0.1)
+
+
+def test_asset_cache_evicts_least_recent():
+    cache = AssetCache(max_bytes=25)
+    for key in "abc":
+        cache.put(key, Asset.build(key.encode() * 10, 'image/png'))
+    # c pushed the oldest entry out
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    cache.put("d", Asset.build(b"d" * 10, 'image/png'))
+    assert cache.get("c") is None
+    assert cache.get("b") is not None
+    assert cache.size == 20
+
+
+def test_single_flight_shares_result():
+    flight = SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return len(calls)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", slow))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert results == [1] * 4
+
+
+def test_render_overrides(tmp_path):
+    provider = CountingProvider()
+    task = fake_task("task", provider, tmp_path / "task.svg")
+    renderer = OnDemandRenderer(max_bytes=1 << 20)
+
+    svg = renderer.render(task, {})
+    assert svg.media_type == 'image/svg+xml'
+    png = renderer.render(task, {'file_type': 'png'})
+    assert png.media_type == 'image/png'
+    # Same window, the data is fetched once
+    assert provider.accessed == 1
+    assert renderer.render(task, {}) is svg
+    # The task itself is not changed
+    assert task.global_config.file_type == 'svg'
+
+
+def test_render_uses_refreshed_data(tmp_path):
+    provider = CountingProvider()
+    task = fake_task("task", provider, tmp_path / "task.svg")
+    renderer = OnDemandRenderer(max_bytes=1 << 20)
+    renderer.reset({"task": task}, {"task": provider.process(None)})
+
+    renderer.render(task, {'color': 'red'})
+    assert provider.accessed == 0
+
+
+def test_concurrent_renders_share_fetch(tmp_path):
+    provider = CountingProvider()
+    task = fake_task("task", provider, tmp_path / "task.svg")
+    renderer = OnDemandRenderer(max_bytes=1 << 20)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(renderer.render(task, {'year': 2021})))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert provider.accessed == 1
+    assert len({asset.etag for asset in results}) == 1
+
+
+def test_render_empty_year(tmp_path):
+    provider = CountingProvider()
+    task = fake_task("task", provider, tmp_path / "task.svg")
+    renderer = OnDemandRenderer(max_bytes=1 << 20)
+
+    # The server answers 404 for a window without data
+    with pytest.raises(ValueError):
+        renderer.render(task, {'year': 2005})
+    assert renderer.assets.size == 0
+    assert renderer.render(task, {}).media_type == 'image/svg+xml'
@@ -0,0 +1,86 @@
+import pickle
+import threading
+import time
+
+from yearmaps.impl.scheduler import Refresher
+from yearmaps.utils import http
+from yearmaps.utils.profile import Profile, StageTiming, Timings, activate, current, record_output, stage
+from tests.test_http import RecordingAdapter
+from tests.test_scheduler import SlowProvider, fake_task
+
+
+class BodyAdapter(RecordingAdapter):
+    def send(self, request, **kwargs):
+        resp = super().send(request, **kwargs)
+        resp._content = b"x" * 100  # pylint: disable=protected-access
+        return resp
+
+
+def test_stage_only_records_when_active():
+    with stage('access'):
+        pass
+    profile = Profile()
+    with activate(profile):
+        assert current() is profile
+        with stage('access'):
+            time.sleep(0.05)
+        with stage('access'):
+            pass
+        record_output(42)
+    assert current() is None
+    assert profile.stages['access'].wall >= 0.05
+    # Sleeping costs no CPU
+    assert profile.stages['access'].cpu < 0.05
+    assert profile.output == 42
+
+
+def test_profile_pickles():
+    profile = Profile()
+    with profile.stage('draw'):
+        pass
+    copy = pickle.loads(pickle.dumps(profile))
+    assert copy.stages == profile.stages
+    with copy.stage('save'):
+        pass
+    profile.merge(copy)
+    assert set(profile.stages) == {'draw', 'save'}
+
+
+def test_fetched_bytes():
+    session = http.Session()
+    session.mount('https://', BodyAdapter())
+    profile = Profile()
+    session.get('https://example.com')
+
+    def fetch():
+        with activate(profile):
+            session.get('https://example.com')
+
+    threads = [threading.Thread(target=fetch) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert profile.fetched == 300
+
+
+def test_timings_histogram():
+    timings = Timings(window=3)
+    for wall in (0.001, 0.2, 2, 20):
+        timings.add("task", "dummy", Profile(stages={'draw': StageTiming(wall=wall)}))
+    draw = timings.summary()['stages']['draw']
+    # The oldest sample left the window
+    assert draw['count'] == 3
+    assert draw['buckets']['0.5'] == 1 and draw['buckets']['5'] == 1 and draw['buckets']['30'] == 1
+    assert draw['max'] == 20
+    assert timings.summary()['tasks']['task']['provider'] == 'dummy'
+
+
+def test_refresh_profiles_stages(tmp_path):
+    refresher = Refresher()
+    refresher.refresh([fake_task("slow", SlowProvider(), tmp_path / "slow.svg")], quiet=True)
+    profile = refresher.profiles["slow"]
+    assert list(profile.as_dict()['stages']) == ['init', 'access', 'process', 'fulfill', 'draw', 'save']
+    assert profile.stages['access'].wall >= 0.3
+    assert profile.output == (tmp_path / "slow.svg").stat().st_size
+    assert refresher.timings.summary()['stages']['access']['count'] == 1
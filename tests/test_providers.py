@@ -1,4 +1,8 @@
-from yearmaps.provider import providers
+import inspect
+import subprocess
+import sys
+
+from yearmaps.provider import get_provider, providers, registry
 from yearmaps.utils.util import option_name
 
 
@@ -11,3 +15,23 @@ def test_no_global_option():
         for param in command.params:
             for opt in param.opts:
                 assert option_name(opt) != 'global'
+
+
+def test_create_matches_command():
+    # The server builds providers from the options of their command
+    for provider in providers:
+        params = {param.name for param in provider.command.params}
+        assert set(inspect.signature(provider.create).parameters) == params
+
+
+def test_registry_matches_commands():
+    # Commands are listed from the registry before their provider is imported
+    assert list(registry) == [provider.command.name for provider in providers]
+    for provider in providers:
+        assert registry[provider.command.name][1] == provider.command.help
+        assert get_provider(provider.command.name) is provider
+
+
+def test_cli_imports_no_provider():
+    code = "import sys, yearmaps.script; print(any(m.startswith('yearmaps.provider.') for m in sys.modules))"
+    assert subprocess.check_output([sys.executable, "-c", code], text=True).strip() == "False"
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from datetime import date, timedelta
+from io import BytesIO
+from xml.etree import ElementTree
+
+from PIL import Image
+
+from yearmaps.constant import Configs
+from yearmaps.impl.provider import Provider
+from yearmaps.impl.png import render_png
+from yearmaps.impl.svg import render_svg
+from yearmaps.utils.colors import blue, red
+from yearmaps.utils.palette import build_palette
+
+
+class DummyProvider(Provider):
+    id = "dummy"
+    name = "Dummy & Co"
+    color = blue
+    unit = "Things"
+
+    def access(self):
+        return None
+
+    def process(self, raw):
+        return {date(2021, 1, 1) + timedelta(days=i): i % 5 for i in range(365)}
+
+    @staticmethod
+    def create(**options):
+        return DummyProvider()
+
+    @staticmethod
+    def command():
+        pass
+
+
+def dummy_heatmap(file_type: str):
+    provider = DummyProvider()
+    provider.options = Configs(data_dir='', output='', mode='year', file_type=file_type, year=2021)
+    return provider.heatmap(provider.process(None))
+
+
+def test_svg_is_well_formed():
+    heatmap = dummy_heatmap('svg')
+    root = ElementTree.fromstring(render_svg(heatmap))
+    rects = root.findall('{http://www.w3.org/2000/svg}rect')
+    # background, one rect per day and one per color bar band
+    assert len(rects) == 1 + 365 + heatmap.palette.N
+    texts = [t.text for t in root.findall('{http://www.w3.org/2000/svg}text')]
+    assert 'Dummy & Co' in texts
+    assert '2021' in texts
+    assert heatmap.analysis in texts
+
+
+def test_png_scale():
+    heatmap = dummy_heatmap('png')
+    small = Image.open(BytesIO(render_png(heatmap, scale=1)))
+    large = Image.open(BytesIO(render_png(heatmap, scale=2)))
+    assert small.format == 'PNG'
+    assert small.width > heatmap.grid.weeks * 10
+    assert 1.8 < large.width / small.width < 2.2
+
+
+def test_figure_template_reuse(monkeypatch):
+    from yearmaps.impl import figure
+
+    monkeypatch.setattr(figure, "_templates", OrderedDict())
+    first, second = dummy_heatmap('png'), dummy_heatmap('png')
+    second.palette = build_palette(red, 5, True)
+    second.title = "Other"
+
+    figure.draw_figure(first, BytesIO(), 'png')
+    reused = BytesIO()
+    figure.draw_figure(second, reused, 'png')
+    assert len(figure._templates) == 1  # pylint: disable=protected-access
+
+    figure._templates.clear()  # pylint: disable=protected-access
+    fresh = BytesIO()
+    figure.draw_figure(second, fresh, 'png')
+    # Nothing of the first heatmap is left in the figure
+    assert reused.getvalue() == fresh.getvalue()
@@ -0,0 +1,143 @@
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from yearmaps.constant import Configs
+from yearmaps.impl.scheduler import Refresher, RefreshQueue, TaskState
+from yearmaps.utils.cache import TaskManifest
+from tests.test_render import DummyProvider
+
+
+class SlowProvider(DummyProvider):
+    def access(self):
+        time.sleep(0.3)
+
+
+class BrokenProvider(DummyProvider):
+    def access(self):
+        raise ConnectionError("unreachable")
+
+
+def fake_task(name, provider, output):
+    config = Configs(data_dir=str(output.parent), output=str(output), mode='year', file_type='svg', year=2021)
+    config.server = True
+    return SimpleNamespace(global_config=config, command_options={}, command=SimpleNamespace(name=name),
+                           provider=lambda: provider, task_hash=lambda: name, task_name=lambda: name)
+
+
+def test_fetch_concurrently(tmp_path):
+    tasks = [fake_task(f"t{i}", SlowProvider(), tmp_path / f"{i}.svg") for i in range(4)]
+    start = time.monotonic()
+    results = Refresher(fetchers=4).refresh(tasks, quiet=True)
+    assert time.monotonic() - start < 1.2
+    assert results == {f"t{i}": None for i in range(4)}
+    assert all((tmp_path / f"{i}.svg").exists() for i in range(4))
+
+
+def test_failed_fetch_is_isolated(tmp_path):
+    tasks = [fake_task("ok", SlowProvider(), tmp_path / "ok.svg"),
+             fake_task("broken", BrokenProvider(), tmp_path / "broken.svg")]
+    results = Refresher().refresh(tasks, quiet=True)
+    assert results["ok"] is None
+    assert results["broken"].startswith("ConnectionError: unreachable")
+
+
+def test_task_states(tmp_path):
+    refresher = Refresher()
+    tasks = [fake_task("ok", SlowProvider(), tmp_path / "ok.svg"),
+             fake_task("broken", BrokenProvider(), tmp_path / "broken.svg")]
+    assert refresher.states.get("ok").state == TaskState.NEVER_RENDERED
+    refresher.refresh(tasks, quiet=True)
+    assert refresher.states.get("ok").state == TaskState.FRESH
+    broken = refresher.states.get("broken")
+    assert broken.state == TaskState.FAILED
+    assert not broken.rendered
+    assert broken.error.startswith("ConnectionError")
+
+
+def test_overlapping_refresh_is_skipped(tmp_path):
+    refresher = Refresher()
+    task = fake_task("slow", SlowProvider(), tmp_path / "slow.svg")
+    first = threading.Thread(target=refresher.refresh, args=([task], True))
+    first.start()
+    time.sleep(0.1)
+    assert refresher.states.get("slow").state == TaskState.RENDERING
+    # The running refresh owns the task
+    assert not refresher.refresh([task], quiet=True)
+    first.join()
+    assert refresher.states.get("slow").state == TaskState.FRESH
+
+
+def interval_task(name, interval, output):
+    task = fake_task(name, DummyProvider(), output)
+    task.interval = interval
+    task.should_run = lambda: True
+    return task
+
+
+def test_refresh_queue_order(tmp_path):
+    queue = RefreshQueue(jitter=0)
+    queue.push(interval_task("slow", 100, tmp_path / "slow.svg"))
+    queue.push(interval_task("fast", 0.05, tmp_path / "fast.svg"))
+    assert 0 < queue.idle_seconds() <= 0.05
+    assert queue.next_run("slow") > queue.next_run("fast")
+    time.sleep(0.06)
+    assert [task.task_hash() for task in queue.pop_due()] == ["fast"]
+    # Past due while it refreshes, so its image is not cached as if it could not change
+    assert queue.next_run("fast") <= time.time()
+    assert len(queue) == 1
+    queue.drop("fast")
+    assert queue.next_run("fast") is None
+
+
+def test_refresh_queue_backoff(tmp_path):
+    queue = RefreshQueue(jitter=0)
+    task = interval_task("task", 10, tmp_path / "task.svg")
+    waits = []
+    for _ in range(5):
+        queue.push(task, changed=False)
+        waits.append(queue.wait(task))
+    assert waits == [20, 40, 80, 80, 80]
+    queue.push(task, changed=True)
+    assert queue.wait(task) == 10
+
+
+def test_refresh_due(tmp_path):
+    queue = RefreshQueue(jitter=0)
+    refresher = Refresher()
+    manifest = TaskManifest(tmp_path)
+    current = interval_task("current", 0.01, tmp_path / "current.svg")
+    ended = interval_task("ended", 0.01, tmp_path / "ended.svg")
+    for task in (current, ended):
+        task.cache_path = lambda task=task: Path(task.global_config.output)
+    queue.push(current)
+    queue.push(ended)
+    time.sleep(0.02)
+    assert set(refresher.refresh_due(queue, manifest, quiet=True)) == {"current", "ended"}
+    assert queue.next_run("current") is not None
+
+    # The year of the task ended, it is refreshed a last time and recorded
+    ended.should_run = lambda: False
+    time.sleep(0.02)
+    assert set(refresher.refresh_due(queue, manifest, quiet=True)) == {"current", "ended"}
+    assert set(manifest.load()) == {"ended"}
+    assert queue.next_run("ended") is None
+    # Same data as the first refresh
+    assert queue.wait(current) == 0.02
+    time.sleep(0.03)
+    assert set(refresher.refresh_due(queue, manifest, quiet=True)) == {"current"}
+
+
+def test_refresh_pending_skips_final_outputs(tmp_path):
+    manifest = TaskManifest(tmp_path)
+    current = interval_task("current", 10, tmp_path / "current.svg")
+    archived = interval_task("archived", 10, tmp_path / "archived.svg")
+    archived.should_run = lambda: False
+    for task in (current, archived):
+        task.cache_path = lambda task=task: Path(task.global_config.output)
+
+    assert set(Refresher().refresh_pending([current, archived], manifest, quiet=True)) == {"current", "archived"}
+    assert set(manifest.load()) == {"archived"}
+    # A new process only refreshes what may have changed
+    assert set(Refresher().refresh_pending([current, archived], manifest, quiet=True)) == {"current"}
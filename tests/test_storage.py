@@ -0,0 +1,86 @@
+import math
+from datetime import date, timedelta
+
+import pytest
+
+from yearmaps.utils import storage
+from yearmaps.utils.storage import stores, open_store
+
+COLUMNS = ("time", "learn")
+
+
+@pytest.mark.parametrize("kind", list(stores))
+def test_write_and_read(tmp_path, kind):
+    store = open_store(kind, tmp_path / "series", COLUMNS)
+    assert store.empty()
+    day = date(2022, 3, 1)
+    store.write({day: {"time": 5, "learn": 20}, day + timedelta(days=2): {"time": 7}})
+    assert not store.empty()
+
+    # Reopened, only the given column of a day is replaced
+    store = open_store(kind, tmp_path / "series", COLUMNS)
+    store.write({day: {"learn": 30}})
+    rows = store.read(date(2022, 1, 1), date(2022, 12, 31))
+    assert list(rows) == [day, day + timedelta(days=2)]
+    assert rows[day] == {"time": 5, "learn": 30}
+    assert math.isnan(rows[day + timedelta(days=2)]["learn"])
+
+
+@pytest.mark.parametrize("kind", list(stores))
+def test_write_before_first_day(tmp_path, kind):
+    store = open_store(kind, tmp_path / "series", COLUMNS)
+    store.write({date(2022, 3, 1): {"time": 1, "learn": 1}})
+    store.write({date(2021, 12, 31): {"time": 2, "learn": 2}})
+    store.write({date(2023, 1, 1): {"time": 3, "learn": 3}})
+    rows = store.read(date(2022, 1, 1), date(2022, 12, 31))
+    assert rows == {date(2022, 3, 1): {"time": 1, "learn": 1}}
+    assert len(store.read(date.min, date.max)) == 3
+
+
+def test_columns_are_checked(tmp_path):
+    open_store("memmap", tmp_path / "series", COLUMNS).write({date(2022, 1, 1): {"time": 1}})
+    with pytest.raises(ValueError):
+        open_store("memmap", tmp_path / "series", ("time",)).read(date.min, date.max)
+    with pytest.raises(KeyError):
+        open_store("sqlite", tmp_path / "series", COLUMNS).write({date(2022, 1, 1): {"words": 1}})
+
+
+def test_crash_during_rebase(monkeypatch, tmp_path):
+    store = open_store("memmap", tmp_path / "series", COLUMNS)
+    store.write({date(2022, 3, 1): {"time": 1, "learn": 1}})
+
+    def crash(path, content):
+        if path.suffix == ".json":
+            raise KeyboardInterrupt()
+        write(path, content)
+
+    write = storage.atomic_write
+    monkeypatch.setattr(storage, "atomic_write", crash)
+    with pytest.raises(KeyboardInterrupt):
+        store.write({date(2022, 1, 1): {"time": 2, "learn": 2}})
+    monkeypatch.undo()
+
+    # The rows written before the crash still start at their own day
+    assert store.read(date.min, date.max) == {date(2022, 3, 1): {"time": 1, "learn": 1}}
+    store.write({date(2022, 1, 1): {"time": 2, "learn": 2}})
+    assert len(store.read(date.min, date.max)) == 2
+    assert len(list(tmp_path.glob("series.*.f8"))) == 1
+
+
+def test_read_during_rebase(tmp_path):
+    store = open_store("memmap", tmp_path / "series", COLUMNS)
+    store.write({date(2022, 3, 1): {"time": 1, "learn": 1}})
+    writer = open_store("memmap", tmp_path / "series", COLUMNS)
+    snapshot, rebased = store.snapshot, []
+
+    # Another writer moves the first day right after the reader took its snapshot
+    def racing():
+        ret = snapshot()
+        if not rebased:
+            rebased.append(True)
+            writer.write({date(2022, 1, 1): {"time": 2, "learn": 2}})
+        return ret
+
+    store.snapshot = racing
+    assert store.read(date(2022, 3, 1), date(2022, 3, 1)) == {date(2022, 3, 1): {"time": 1, "learn": 1}}
+    assert len(store.read(date.min, date.max)) == 2
@@ -1,5 +1,5 @@
 import hashlib
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import timedelta
 from copy import deepcopy
 
@@ -13,6 +13,14 @@ class Configs:
     year: int = None
     color: str = None
     server: bool = None
+    # Rendering backend, does not change what is drawn so it is left out of the hash
+    renderer: str = field(default=None, repr=False)
+    # Pixels per point of the native png renderer
+    scale: float = field(default=None, repr=False)
+    # Backend of per-day history kept in the data dir
+    storage: str = field(default=None, repr=False)
+    # Output file name in the output dir, {id}.{file_type} when not set
+    filename: str = field(default=None, repr=False)
 
     def hash(self):
         a = deepcopy(self)
@@ -0,0 +1,148 @@
+import gzip
+import hashlib
+import mimetypes
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple, Union
+
+from yearmaps.utils.file import atomic_write
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always served
+    brotli = None
+
+# Text outputs worth compressing, png is compressed already
+COMPRESSIBLE = ('image/svg+xml',)
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+# Available encodings, preferred first
+def compressors() -> Dict[str, Callable[[bytes], bytes]]:
+    ret = {}
+    if brotli is not None:
+        ret['br'] = lambda body: brotli.compress(body, quality=11)
+    # A fixed mtime keeps the output, and so its etag, stable
+    ret['gzip'] = lambda body: gzip.compress(body, compresslevel=9, mtime=0)
+    return ret
+
+
+def media_type_of(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def variant_path(path: Path, encoding: str) -> Path:
+    return path.with_name(path.name + SUFFIXES[encoding])
+
+
+# Store compressed copies next to a rendered output, so they are built once per render
+def write_variants(path: Union[str, Path]):
+    path = Path(path)
+    body = path.read_bytes()
+    for encoding, compress in compressors().items():
+        atomic_write(variant_path(path, encoding), compress(body))
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> Set[str]:
+    ret, refused = set(), set()
+    for item in (accept_encoding or '').split(','):
+        name, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0
+        if name:
+            (ret if quality > 0 else refused).add(name.lower())
+    # The wildcard stands for codings not named, those refused with q=0 stay refused
+    if '*' in ret:
+        ret.update(SUFFIXES)
+    return ret - refused
+
+
+@dataclass(frozen=True)
+class Asset:
+    body: bytes
+    etag: str
+    media_type: str
+    # Compressed bodies by content coding, preferred first
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, body: bytes, media_type: str, variants: Optional[Dict[str, bytes]] = None) -> 'Asset':
+        if variants is None:
+            variants = {}
+            if media_type in COMPRESSIBLE:
+                variants = {encoding: compress(body) for encoding, compress in compressors().items()}
+        return cls(body, f'"{hashlib.sha256(body).hexdigest()}"', media_type, variants)
+
+    # Bytes held in memory
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(body) for body in self.variants.values())
+
+    # Body for the Accept-Encoding of a request, with its content coding and etag
+    def select(self, accept_encoding: Optional[str]) -> Tuple[Optional[str], bytes, str]:
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, body in self.variants.items():
+            if encoding in accepted:
+                # Every representation needs its own strong etag
+                return encoding, body, f'{self.etag[:-1]}-{encoding}"'
+        return None, self.body, self.etag
+
+    # Whether an If-None-Match header names the etag
+    @staticmethod
+    def matches(if_none_match: Optional[str], etag: str) -> bool:
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        # Weak comparison is what RFC 7232 asks for on If-None-Match
+        return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+class AssetStore:
+    """
+    Rendered outputs kept in memory by the server.
+
+    The refresh job loads every output once it is written, so requests are
+    answered without touching the disk. The ETag is derived from the
+    content, it changes only when the image does. Text outputs also keep
+    their compressed variants, so no request pays for compression.
+    """
+
+    def __init__(self):
+        self._assets: Dict[str, Asset] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def variants(path: Path, body: bytes) -> Dict[str, bytes]:
+        ret = {}
+        for encoding, compress in compressors().items():
+            stored = variant_path(path, encoding)
+            if stored.is_file() and stored.stat().st_mtime >= path.stat().st_mtime:
+                ret[encoding] = stored.read_bytes()
+            else:
+                ret[encoding] = compress(body)
+        return ret
+
+    def load(self, key: str, path: Union[str, Path]) -> Optional[Asset]:
+        path = Path(path)
+        if not path.is_file():
+            return None
+        body = path.read_bytes()
+        current = self.get(key)
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        if current is not None and current.etag == etag:
+            return current
+        media_type = media_type_of(path.name)
+        asset = Asset.build(body, media_type, self.variants(path, body) if media_type in COMPRESSIBLE else {})
+        with self._lock:
+            self._assets[key] = asset
+        return asset
+
+    def get(self, key: str) -> Optional[Asset]:
+        with self._lock:
+            return self._assets.get(key)
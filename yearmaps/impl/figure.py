@@ -0,0 +1,163 @@
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Tuple, Union
+
+import matplotlib as mpl
+import matplotlib.axes
+import matplotlib.figure
+from matplotlib.axes import Axes
+from matplotlib.ticker import ScalarFormatter
+from matplotlib.transforms import Bbox
+
+from yearmaps.impl.heatmap import Heatmap, LABEL_COLOR, YEAR_COLOR, SANS_SERIF
+from yearmaps.utils.colormap import MaskedListedColorMap
+
+
+# Figures are shared between renders, threads must draw one at a time
+_lock = threading.Lock()
+
+# Layouts kept alive, a process rarely needs more than a few
+MAX_TEMPLATES = 8
+_templates: 'OrderedDict[Tuple[int, str, str], FigureTemplate]' = OrderedDict()
+
+
+# Draw heatmap with matplotlib, supports every file type matplotlib can save
+def draw_figure(heatmap: Heatmap, path: Union[str, BinaryIO], file_type: str):
+    key = FigureTemplate.key(heatmap, file_type)
+    with _lock:
+        template = _templates.get(key)
+        if template is None:
+            template = _templates[key] = FigureTemplate(heatmap)
+            if len(_templates) > MAX_TEMPLATES:
+                _templates.popitem(last=False)
+        else:
+            _templates.move_to_end(key)
+        template.draw(heatmap, path, file_type)
+
+
+class FigureTemplate:
+    """
+    Figure, axes, color bar and texts of one layout, built once.
+
+    The layout depends on the number of weeks and the mode only, so later
+    heatmaps of the same layout just update the mesh, its colors and the
+    texts before saving. Figures are built without pyplot, nothing is left
+    in its global state.
+    """
+
+    def __init__(self, heatmap: Heatmap):
+        mpl.rcParams['font.family'] = 'monospace'
+        mpl.rcParams['svg.fonttype'] = 'none'
+        mpl.rcParams['font.sans-serif'] = SANS_SERIF
+
+        fig_size = (10, 3)
+        self.fig = matplotlib.figure.Figure(figsize=fig_size, dpi=400)
+        ax: matplotlib.axes.Axes = self.fig.add_subplot()
+        self.ax = ax
+
+        self.mesh = ax.pcolormesh(heatmap.grid.values, edgecolors=ax.get_facecolor(), linewidth=1,
+                                  cmap=self.colormap(heatmap))
+        ax.invert_yaxis()
+        ax.set_aspect("equal")
+
+        # add weekdays label
+        ax.tick_params(axis="y", which="major", pad=1, width=0, colors=LABEL_COLOR)
+
+        ax.set_yticks([x + 0.5 for x in range(1, 6, 2)])
+        ax.set_yticklabels(
+            ['Tue', 'Thu', 'Sat'],
+        )
+
+        # add months label
+        ax.tick_params(axis="x", which="major", pad=1, width=0, color=LABEL_COLOR)
+        ax.xaxis.tick_top()
+
+        self.year_axis = None
+        if heatmap.year_label is not None:
+            self.year_axis = ax.secondary_xaxis('bottom')
+            self.year_axis.tick_params(axis="x", pad=0, width=0, color=LABEL_COLOR)
+            self.year_axis.set_frame_on(False)
+
+        # Remove the axis spines
+        ax.set_frame_on(False)
+
+        bbox: Bbox = ax.get_position()
+        self.cax: Axes = self.fig.add_axes(
+            [
+                bbox.x1 + 0.015,
+                bbox.y0,
+                0.015,
+                bbox.height
+            ]
+        )
+        self.cax.set_frame_on(False)
+        self.fig.colorbar(self.mesh, cax=self.cax, format=ScalarFormatter())
+        self.cax.tick_params(axis="y", which="major", pad=0, width=0)
+
+        font_family = 'sans-serif'
+        hint_font_dict = {
+            'fontfamily': font_family,
+        }
+
+        title_font_dict = {'fontsize': 30,
+                           'fontfamily': font_family,
+                           'fontweight': 'bold'}
+        self.title = ax.set_title('', fontdict=title_font_dict, pad=15, loc='left')
+
+        year_font_dict = {
+            **hint_font_dict,
+            'fontsize': 28,
+            'color': YEAR_COLOR,
+            'fontweight': 'bold'
+        }
+
+        # overall analysis
+        self.analysis = ax.text(1, 1.25, '',
+                                horizontalalignment='right',
+                                verticalalignment='bottom',
+                                fontdict=hint_font_dict,
+                                transform=ax.transAxes)
+
+        # year analysis on the left
+        self.side_label = None
+        if heatmap.side_label is not None:
+            self.side_label = ax.text(-0.075, 0.6, '',
+                                      horizontalalignment='center',
+                                      verticalalignment='center',
+                                      fontdict=year_font_dict,
+                                      rotation=90,
+                                      transform=ax.transAxes)
+
+    @staticmethod
+    def key(heatmap: Heatmap, file_type: str) -> Tuple[int, str, str]:
+        return heatmap.grid.weeks, 'till_now' if heatmap.year_label is not None else 'year', file_type
+
+    @staticmethod
+    def colormap(heatmap: Heatmap) -> MaskedListedColorMap:
+        return MaskedListedColorMap(heatmap.palette, heatmap.grid.padding, heatmap.zero)
+
+    def draw(self, heatmap: Heatmap, path: Union[str, BinaryIO], file_type: str):
+        ax = self.ax
+        self.mesh.set_array(heatmap.grid.values)
+        self.mesh.set_cmap(self.colormap(heatmap))
+        self.mesh.set_clim(heatmap.vmin, heatmap.vmax)
+
+        ax.set_xticks([loc for loc, _ in heatmap.months])
+        ax.set_xticklabels([label for _, label in heatmap.months], ha="center")
+
+        if heatmap.year_label is not None:
+            year_loc, year = heatmap.year_label
+            self.year_axis.set_xticks([year_loc])
+            self.year_axis.set_xticklabels([year], ha="left")
+
+        # Color bar label
+        self.cax.set_yticks([value for value, _ in heatmap.ticks])
+        self.cax.set_yticklabels(labels=[label for _, label in heatmap.ticks], fontdict={'fontfamily': 'monospace'})
+
+        self.title.set_text(heatmap.title)
+        self.analysis.set_text(heatmap.analysis)
+        if heatmap.side_label is not None:
+            self.side_label.set_text(heatmap.side_label)
+
+        # save the figure
+        self.fig.savefig(path, bbox_inches='tight', pad_inches=0.1, format=file_type)
@@ -0,0 +1,54 @@
+import calendar
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from yearmaps.utils.grid import Grid
+from yearmaps.utils.palette import Palette
+
+LABEL_COLOR = '#24292f'
+YEAR_COLOR = '#A9A9A9'
+SANS_SERIF = ['Microsoft YaHei', 'Noto Sans CJK SC', 'Noto Sans CJK JP', 'Noto Sans CJK']
+
+
+@dataclass
+class Heatmap:  # pylint: disable=too-many-instance-attributes
+    """
+    Everything a backend needs to draw a heatmap, independent of the drawing library.
+    """
+    grid: Grid
+    palette: Palette
+    # Cells holding zero values when zero has a dedicated color
+    zero: Optional[np.ndarray]
+    vmin: float
+    vmax: float
+    title: str
+    analysis: str
+    # Color bar tick values and labels
+    ticks: List[Tuple[float, str]]
+    # Month label positions in weeks
+    months: List[Tuple[float, str]]
+    # Year label below the grid for till_now mode
+    year_label: Optional[Tuple[float, str]]
+    # Rotated year on the left side for year mode
+    side_label: Optional[str]
+
+    def normalize(self, values: np.ndarray) -> np.ndarray:
+        return (values - self.vmin) / (self.vmax - self.vmin)
+
+    def cell_colors(self) -> np.ndarray:
+        return self.palette.paint(self.normalize(self.grid.values), padding=self.grid.padding, zero=self.zero)
+
+
+def month_labels(months: np.ndarray) -> List[Tuple[float, str]]:
+    # A label starts wherever the month changes, weeks without a Monday in range (-1) get none
+    starts = np.flatnonzero(months != np.concatenate(([-1], months[:-1])))
+    labels = [(i + 0.5, calendar.month_abbr[int(months[i])]) for i in starts]
+
+    # trick to remove too close labels
+    if labels[1][0] - labels[0][0] < 4:
+        labels.pop(0)
+    if labels[-1][0] - labels[-2][0] < 4:
+        labels.pop()
+    return labels
@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from yearmaps.constant import Configs
+from yearmaps.impl.assets import Asset, media_type_of
+from yearmaps.impl.task import Task
+from yearmaps.utils import YearData
+from yearmaps.utils.flight import SingleFlight
+from yearmaps.utils.metrics import CACHE_REQUESTS
+
+# Options a request may override
+OVERRIDES = ('color', 'file_type', 'mode', 'year')
+
+Window = Tuple[str, str, Optional[int]]
+
+
+class AssetCache:
+    """
+    Least recently used assets, bounded by the bytes they hold.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._assets: 'OrderedDict[str, Asset]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Asset]:
+        with self._lock:
+            asset = self._assets.get(key)
+            if asset is not None:
+                self._assets.move_to_end(key)
+            return asset
+
+    def put(self, key: str, asset: Asset):
+        with self._lock:
+            if key in self._assets:
+                self.size -= self._assets.pop(key).size
+            self._assets[key] = asset
+            self.size += asset.size
+            while self.size > self.max_bytes and len(self._assets) > 1:
+                _, evicted = self._assets.popitem(last=False)
+                self.size -= evicted.size
+
+
+class OnDemandRenderer:
+    """
+    Renders configured tasks with options overridden per request.
+
+    Data of the window a task refreshes comes from the refresh job. Other
+    windows, another mode or year, are fetched on the first request and
+    kept until the next refresh. Identical requests running at the same
+    time share one fetch and one render, and results are kept in a size
+    bounded LRU keyed by the render key of the provider, which covers the
+    data and every option.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.assets = AssetCache(max_bytes)
+        self.flight = SingleFlight()
+        self._data: Dict[Window, YearData] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def window(task: Task, configs: Configs) -> Window:
+        return task.task_hash(), configs.mode, configs.year
+
+    # Replace fetched data with what the refresh job collected
+    def reset(self, tasks: Dict[str, Task], data: Dict[str, YearData]):
+        with self._lock:
+            self._data = {self.window(tasks[task_hash], tasks[task_hash].global_config): value
+                          for task_hash, value in data.items() if task_hash in tasks}
+
+    @staticmethod
+    def configs(task: Task, overrides: Dict) -> Configs:
+        configs = deepcopy(task.global_config)
+        configs.output = None
+        for key, value in overrides.items():
+            setattr(configs, key, value)
+        # Like the command line, a year means year mode
+        if 'year' in overrides:
+            configs.mode = 'year'
+        if configs.mode == 'year' and configs.year is None:
+            configs.year = datetime.now().year
+        if configs.mode == 'till_now':
+            configs.year = None
+        return configs
+
+    def data(self, task: Task, configs: Configs) -> YearData:
+        window = self.window(task, configs)
+        with self._lock:
+            data = self._data.get(window)
+        if data is not None:
+            return data
+
+        def fetch():
+            data = task.provider().collect(configs)
+            with self._lock:
+                self._data[window] = data
+            return data
+
+        return self.flight.do(('data', window), fetch)
+
+    def render(self, task: Task, overrides: Dict) -> Asset:
+        configs = self.configs(task, overrides)
+        data = self.data(task, configs)
+        provider = task.provider()
+        provider.options = configs
+        key = provider.render_key(data)
+        asset = self.assets.get(key)
+        if asset is not None:
+            CACHE_REQUESTS.inc(cache='ondemand', result='hit')
+            return asset
+        CACHE_REQUESTS.inc(cache='ondemand', result='miss')
+
+        def draw():
+            asset = Asset.build(provider.image(data), media_type_of(f"image.{configs.file_type}"))
+            self.assets.put(key, asset)
+            return asset
+
+        return self.flight.do(('render', key), draw)
@@ -0,0 +1,124 @@
+import io
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from yearmaps.impl.heatmap import Heatmap, LABEL_COLOR, YEAR_COLOR, SANS_SERIF
+from yearmaps.impl.svg import CELL, GAP, FONT_SIZE, TITLE_SIZE, YEAR_SIZE, COLOR_BAR_OFFSET, COLOR_BAR_WIDTH, PAD
+
+# Pixels per point, 4 gives an image about as wide as the matplotlib one
+DEFAULT_SCALE = 4
+
+WHITE = 255
+
+
+@lru_cache(maxsize=None)
+def font_path(family: str, bold: bool) -> str:
+    # font_manager is light compared to pyplot and keeps its own cache of system fonts
+    from matplotlib import font_manager
+    families = SANS_SERIF + ['DejaVu Sans'] if family == 'sans-serif' else ['DejaVu Sans Mono', 'monospace']
+    prop = font_manager.FontProperties(family=families, weight='bold' if bold else 'normal')
+    return font_manager.findfont(prop, fallback_to_default=True)
+
+
+@lru_cache(maxsize=64)
+def load_font(family: str, size: int, bold: bool = False) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path(family, bold), size)
+
+
+def composite(rgba: np.ndarray) -> np.ndarray:
+    # Blend float colors over the white background
+    alpha = rgba[..., 3:]
+    rgb = rgba[..., :3] * alpha + (1 - alpha)
+    return np.rint(rgb * 255).astype(np.uint8)
+
+
+def paint_cells(buffer: np.ndarray, heatmap: Heatmap, x: int, y: int, cell: int, gap: int):
+    colors = composite(heatmap.cell_colors())
+    block = np.repeat(np.repeat(colors, cell, axis=0), cell, axis=1)
+    # Leave a white gap on the trailing edge of every cell
+    edge = np.arange(cell) >= cell - gap
+    rows = np.tile(edge, 7)
+    cols = np.tile(edge, heatmap.grid.weeks)
+    block[rows, :] = WHITE
+    block[:, cols] = WHITE
+    buffer[y:y + block.shape[0], x:x + block.shape[1], :3] = block
+
+
+def paint_color_bar(buffer: np.ndarray, heatmap: Heatmap, x: int, y: int, width: int, height: int):
+    lut = composite(heatmap.palette.lut)
+    # Row 0 is the top of the bar, holding the highest color
+    index = ((height - 1 - np.arange(height)) * len(lut)) // height
+    buffer[y:y + height, x:x + width, :3] = lut[index][:, np.newaxis, :]
+
+
+def render_png(heatmap: Heatmap, scale: float = DEFAULT_SCALE) -> bytes:
+    cell = max(2, round(CELL * scale))
+    gap = max(1, round(GAP * scale))
+    width = heatmap.grid.weeks * cell
+    height = 7 * cell
+
+    def pt(value: float) -> int:
+        return round(value * scale)
+
+    # Draw on a generous canvas with the grid at (ox, oy) and crop afterwards
+    ox, oy = pt(90), pt(80)
+    canvas_width = ox + width + pt(COLOR_BAR_OFFSET + COLOR_BAR_WIDTH + 80)
+    canvas_height = oy + height + pt(40)
+    buffer = np.full((canvas_height, canvas_width, 4), WHITE, dtype=np.uint8)
+
+    paint_cells(buffer, heatmap, ox, oy, cell, gap)
+    bar_x = ox + width + pt(COLOR_BAR_OFFSET)
+    paint_color_bar(buffer, heatmap, bar_x, oy, pt(COLOR_BAR_WIDTH), height)
+
+    image = Image.fromarray(buffer, 'RGBA')
+    draw = ImageDraw.Draw(image)
+    label_font = load_font('monospace', pt(FONT_SIZE))
+    hint_font = load_font('sans-serif', pt(FONT_SIZE))
+
+    # weekdays label
+    for row, label in ((1, 'Tue'), (3, 'Thu'), (5, 'Sat')):
+        draw.text((ox - pt(2), oy + (row + 0.5) * cell), label, fill=LABEL_COLOR, font=label_font, anchor='rm')
+
+    # months label
+    for loc, label in heatmap.months:
+        draw.text((ox + loc * cell, oy - pt(4)), label, fill='black', font=label_font, anchor='ms')
+
+    if heatmap.year_label is not None:
+        year_loc, year = heatmap.year_label
+        draw.text((ox + year_loc * cell, oy + height + pt(2)), year, fill='black', font=label_font, anchor='lt')
+
+    # Color bar label
+    for value, label in heatmap.ticks:
+        ty = oy + height - heatmap.normalize(value) * height
+        draw.text((bar_x + pt(COLOR_BAR_WIDTH + 2), ty), label, fill='black', font=label_font, anchor='lm')
+
+    # overall analysis
+    draw.text((ox + width, oy - 0.25 * height - pt(2)), heatmap.analysis, fill='black', font=hint_font, anchor='rs')
+
+    title_font = load_font('sans-serif', pt(TITLE_SIZE), bold=True)
+    draw.text((ox, oy - pt(4 + FONT_SIZE * 1.2 + 15)), heatmap.title, fill='black', font=title_font, anchor='ls')
+
+    # year analysis on the left
+    if heatmap.side_label is not None:
+        year_font = load_font('sans-serif', pt(YEAR_SIZE), bold=True)
+        left, top, right, bottom = year_font.getbbox(heatmap.side_label, anchor='lt')
+        label = Image.new('RGBA', (right - left, bottom - top), (WHITE, WHITE, WHITE, 0))
+        ImageDraw.Draw(label).text((-left, -top), heatmap.side_label, fill=YEAR_COLOR, font=year_font, anchor='lt')
+        label = label.rotate(90, expand=True)
+        cx, cy = ox - 0.075 * width, oy + 0.4 * height
+        image.alpha_composite(label, (round(cx - label.width / 2), round(cy - label.height / 2)))
+
+    # Crop to the drawn content like bbox_inches='tight'
+    # Compare whole pixels at once, the background is opaque white
+    drawn = np.asarray(image).view(np.uint32)[..., 0] != np.uint32(0xFFFFFFFF)
+    rows = np.flatnonzero(drawn.any(axis=1))
+    cols = np.flatnonzero(drawn.any(axis=0))
+    pad = pt(PAD)
+    top, bottom = max(rows[0] - pad, 0), min(rows[-1] + 1 + pad, canvas_height)
+    left, right = max(cols[0] - pad, 0), min(cols[-1] + 1 + pad, canvas_width)
+
+    output = io.BytesIO()
+    image.crop((left, top, right, bottom)).save(output, format='PNG')
+    return output.getvalue()
@@ -0,0 +1,405 @@
+import asyncio
+import heapq
+import itertools
+import math
+import multiprocessing
+import multiprocessing.pool
+import random
+import signal
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+import click
+
+from yearmaps.constant import Configs
+from yearmaps.impl.provider import Provider
+from yearmaps.impl.task import Task
+from yearmaps.provider import get_provider
+from yearmaps.utils import YearData
+from yearmaps.utils.cache import TaskManifest, data_hash
+from yearmaps.utils.metrics import (CACHE_REQUESTS, FETCH_DURATION, FETCH_FAILURES, REFRESH_DURATION,
+                                    RENDER_DURATION, RENDER_FAILURES)
+from yearmaps.utils.profile import Profile, Timings, activate
+
+Collected = Tuple[Task, Provider, YearData]
+
+# Longest wait of a task whose data does not change, as a multiple of its interval
+MAX_BACKOFF = 8
+# Share of an interval a due time is moved by at random
+JITTER = 0.1
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    # SIGALRM only exists on Unix and only works in the main thread, which is where pool workers run tasks
+    if not seconds or not hasattr(signal, 'SIGALRM'):
+        yield
+        return
+
+    def on_alarm(_signum, _frame):
+        raise TimeoutError(f"Task exceeded {seconds} seconds")
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def format_error(e: BaseException) -> str:
+    return f"{type(e).__name__}: {e}\n{''.join(traceback.format_exception(type(e), e, e.__traceback__))}"
+
+
+def profiled(profile: Profile, fn, *args):
+    with activate(profile):
+        return fn(*args)
+
+
+# Entry of pool workers, everything passed in must be picklable
+def draw_spec(command_name: str, configs: Configs, options: Dict, data: YearData,
+              timeout: Optional[float]) -> Tuple[Optional[str], Profile]:
+    profile = Profile()
+    try:
+        provider = get_provider(command_name).create(**options)
+        provider.options = configs
+        with deadline(timeout), activate(profile):
+            provider.draw(data)
+    except Exception as e:  # pylint: disable=broad-except
+        # Only send back text, the exception itself may not survive pickling
+        return format_error(e), profile
+    return None, profile
+
+
+class TaskState(Enum):
+    NEVER_RENDERED = 'never_rendered'
+    RENDERING = 'rendering'
+    FRESH = 'fresh'
+    STALE = 'stale'
+    FAILED = 'failed'
+
+
+@dataclass
+class TaskStatus:
+    state: TaskState = TaskState.NEVER_RENDERED
+    # Whether an output exists, the last good one is served whatever the state
+    rendered: bool = False
+    error: Optional[str] = None
+    # Unix time of the last successful refresh
+    succeeded: Optional[float] = None
+
+
+class TaskStates:
+    """
+    Where every task is in its refresh, and a claim per task so a task is
+    never refreshed twice at the same time.
+    """
+
+    def __init__(self):
+        self._status: Dict[str, TaskStatus] = {}
+        self._lock = threading.Lock()
+
+    def get(self, task_hash: str) -> TaskStatus:
+        with self._lock:
+            status = self._status.get(task_hash, TaskStatus())
+            return TaskStatus(status.state, status.rendered, status.error, status.succeeded)
+
+    # Outputs left by an earlier run are served, current only if they can not change
+    def found(self, task_hash: str, immutable: bool = False):
+        with self._lock:
+            status = self._status.setdefault(task_hash, TaskStatus())
+            if status.state == TaskState.NEVER_RENDERED:
+                status.state = TaskState.FRESH if immutable else TaskState.STALE
+                status.rendered = True
+
+    # Mark the tasks as rendering, and return those no other refresh is working on
+    def claim(self, tasks: List[Task]) -> List[Task]:
+        claimed = []
+        with self._lock:
+            for task in tasks:
+                status = self._status.setdefault(task.task_hash(), TaskStatus())
+                if status.state != TaskState.RENDERING:
+                    status.state = TaskState.RENDERING
+                    claimed.append(task)
+        return claimed
+
+    def finish(self, task_hash: str, error: Optional[str]):
+        with self._lock:
+            status = self._status.setdefault(task_hash, TaskStatus())
+            if error is None:
+                status.state = TaskState.FRESH
+                status.rendered = True
+                status.error = None
+                status.succeeded = time.time()
+            else:
+                status.state = TaskState.FAILED
+                status.error = error
+
+
+class RefreshQueue:
+    """
+    Due times of tasks in a heap, every task refreshed on its own interval.
+
+    A refresh finding the data unchanged doubles the wait of its task, up
+    to MAX_BACKOFF times the interval, and changed data resets it. Due
+    times are jittered, so tasks sharing an interval spread over it
+    instead of all hitting upstream at once.
+    """
+
+    def __init__(self, jitter: float = JITTER):
+        self.jitter = jitter
+        self._heap: List[Tuple[float, int, Task]] = []
+        self._due: Dict[str, float] = {}
+        self._backoff: Dict[str, int] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._heap)
+
+    def wait(self, task: Task) -> float:
+        backoff = min(2 ** self._backoff.get(task.task_hash(), 0), MAX_BACKOFF)
+        return task.interval * backoff * (1 + random.uniform(-self.jitter, self.jitter))
+
+    # Schedule the next refresh, changed is None when the refresh failed or did not happen
+    def push(self, task: Task, changed: Optional[bool] = None):
+        task_hash = task.task_hash()
+        with self._lock:
+            if changed:
+                self._backoff[task_hash] = 0
+            elif changed is not None and 2 ** self._backoff.get(task_hash, 0) < MAX_BACKOFF:
+                self._backoff[task_hash] = self._backoff.get(task_hash, 0) + 1
+            due = time.time() + self.wait(task)
+            self._due[task_hash] = due
+            heapq.heappush(self._heap, (due, next(self._counter), task))
+
+    # Due tasks leave the heap, their due time is kept until they are pushed again or dropped
+    def pop_due(self) -> List[Task]:
+        ret = []
+        now = time.time()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, task = heapq.heappop(self._heap)
+                ret.append(task)
+        return ret
+
+    # Forget a popped task that will never be refreshed again
+    def drop(self, task_hash: str):
+        with self._lock:
+            self._due.pop(task_hash, None)
+            self._backoff.pop(task_hash, None)
+
+    # Seconds until the first task is due, None if nothing is scheduled
+    def idle_seconds(self) -> Optional[float]:
+        with self._lock:
+            if not self._heap:
+                return None
+            return self._heap[0][0] - time.time()
+
+    # Tasks whose refresh is past due, waiting for a running refresh to finish
+    def overdue(self) -> int:
+        now = time.time()
+        with self._lock:
+            return sum(1 for due, _, _ in self._heap if due <= now)
+
+    # Unix time of the next refresh of a task, in the past while it refreshes, None if it is not scheduled
+    def next_run(self, task_hash: str) -> Optional[float]:
+        with self._lock:
+            return self._due.get(task_hash)
+
+
+class Refresher:
+    """
+    Refreshes tasks in two stages.
+
+    Fetching mostly waits on the network, so all tasks are fetched at once
+    from an asyncio loop, at most `fetchers` at a time. Rendering is CPU
+    bound and pyplot keeps global state, so the processed data is drawn on
+    a bounded process pool, or in the calling process with a single worker.
+    A failing task is reported and does not stop the others, and a task
+    already refreshing elsewhere is skipped instead of drawn twice.
+    """
+
+    def __init__(self, workers: int = 1, timeout: Optional[float] = None, fetchers: int = 8):
+        self.workers = workers
+        self.timeout = timeout
+        self.fetchers = fetchers
+        # Processed data of the last successful fetch of every task
+        self.data: Dict[str, YearData] = {}
+        self.states = TaskStates()
+        # Profile of the last refresh of every task, and histograms over recent ones
+        self.profiles: Dict[str, Profile] = {}
+        self.timings = Timings()
+        self._pool = None
+
+    def pool(self):
+        if self._pool is None:
+            # spawn keeps the server threads and their locks out of the workers
+            self._pool = multiprocessing.get_context('spawn').Pool(self.workers)
+        return self._pool
+
+    def terminate(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def refresh(self, tasks: List[Task], quiet: bool = False) -> Dict[str, Optional[str]]:
+        tasks = self.states.claim(tasks)
+        results: Dict[str, Optional[str]] = {}
+        collected: List[Collected] = []
+        start = time.perf_counter()
+        try:
+            collected, results = asyncio.run(self.fetch_all(tasks, quiet))
+            for task, _, data in collected:
+                self.data[task.task_hash()] = data
+            if self.workers <= 1:
+                for task, provider, data in collected:
+                    results[task.task_hash()] = self.draw_local(provider, data, self.profiles[task.task_hash()])
+            else:
+                results.update(self.draw_pool(collected))
+        finally:
+            fetched = {task.task_hash() for task, _, _ in collected}
+            for task in tasks:
+                results.setdefault(task.task_hash(), "Cancelled: refresh was interrupted")
+                self.record(task, results[task.task_hash()], task.task_hash() in fetched)
+            if tasks:
+                REFRESH_DURATION.observe(time.perf_counter() - start)
+
+        for task in tasks:
+            error = results[task.task_hash()]
+            if error is not None:
+                click.echo(f"Failed to refresh {task.task_name()}\n{error}", err=True)
+        return results
+
+    # Update the state, timings and metrics of a task once its refresh is over
+    def record(self, task: Task, error: Optional[str], fetched: bool):
+        task_hash, provider = task.task_hash(), task.command.name
+        self.states.finish(task_hash, error)
+        profile = self.profiles.get(task_hash, Profile())
+        self.timings.add(task_hash, provider, profile)
+
+        def wall(*stages: str) -> float:
+            return sum(profile.stages[name].wall for name in stages if name in profile.stages)
+
+        if not fetched:
+            FETCH_FAILURES.inc(provider=provider)
+            return
+        FETCH_DURATION.observe(wall('init', 'access', 'process'), provider=provider)
+        if error is not None:
+            RENDER_FAILURES.inc(provider=provider)
+        elif 'draw' in profile.stages:
+            CACHE_REQUESTS.inc(cache='render', result='miss')
+            RENDER_DURATION.observe(wall('fulfill', 'draw', 'save'), provider=provider)
+        else:
+            # The render cache found the image up to date
+            CACHE_REQUESTS.inc(cache='render', result='hit')
+
+    def digest(self, task_hash: str) -> Optional[str]:
+        data = self.data.get(task_hash)
+        return None if data is None else data_hash(data)
+
+    # Refresh every task except those the manifest holds a final output of, and record new final outputs
+    def refresh_pending(self, tasks: List[Task], manifest: TaskManifest,
+                        quiet: bool = False) -> Dict[str, Optional[str]]:
+        tasks = [task for task in tasks
+                 if task.should_run() or not manifest.is_done(task.task_hash(), task.cache_path())]
+        results = self.refresh(tasks, quiet)
+        for task in tasks:
+            task_hash = task.task_hash()
+            if not task.should_run() and task_hash in results and results[task_hash] is None:
+                manifest.record(task_hash, self.digest(task_hash))
+        return results
+
+    # Refresh the tasks that are due, then schedule them again. A task that can no longer change,
+    # such as a year that just ended, gets a last refresh recorded in the manifest and is dropped.
+    def refresh_due(self, queue: RefreshQueue, manifest: TaskManifest,
+                    quiet: bool = False) -> Dict[str, Optional[str]]:
+        tasks = queue.pop_due()
+        before = {task.task_hash(): self.digest(task.task_hash()) for task in tasks}
+        results = self.refresh_pending(tasks, manifest, quiet)
+        for task in tasks:
+            task_hash = task.task_hash()
+            if not task.should_run() and manifest.is_done(task_hash, task.cache_path()):
+                queue.drop(task_hash)
+                continue
+            changed = None
+            if task_hash in results and results[task_hash] is None:
+                changed = before[task_hash] != self.digest(task_hash)
+            queue.push(task, changed)
+        return results
+
+    async def fetch_all(self, tasks: List[Task], quiet: bool) -> Tuple[List[Collected], Dict[str, Optional[str]]]:
+        # The providers use blocking clients, so each fetch holds a thread while asyncio overlaps the waits
+        executor = ThreadPoolExecutor(max_workers=self.fetchers, thread_name_prefix='yearmaps-fetch')
+        semaphore = asyncio.Semaphore(self.fetchers)
+        try:
+            outcomes = await asyncio.gather(*(self.fetch(executor, semaphore, task, quiet) for task in tasks),
+                                            return_exceptions=True)
+        finally:
+            # A fetch past its timeout still holds its thread, do not wait for it
+            executor.shutdown(wait=False)
+
+        collected: List[Collected] = []
+        errors: Dict[str, Optional[str]] = {}
+        for task, outcome in zip(tasks, outcomes):
+            if isinstance(outcome, BaseException):
+                errors[task.task_hash()] = format_error(outcome)
+            else:
+                collected.append((task, *outcome))
+        return collected, errors
+
+    async def fetch(self, executor: ThreadPoolExecutor, semaphore: asyncio.Semaphore,
+                    task: Task, quiet: bool) -> Tuple[Provider, YearData]:
+        async with semaphore:
+            if not quiet:
+                click.echo(f"Updating cache for {task.global_config} {task.command_options}")
+            provider = task.provider()
+            profile = self.profiles[task.task_hash()] = Profile()
+            future = asyncio.get_running_loop().run_in_executor(executor, profiled, profile, provider.collect,
+                                                                task.global_config)
+            try:
+                data = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Fetch exceeded {self.timeout} seconds") from None
+            return provider, data
+
+    @staticmethod
+    def draw_local(provider: Provider, data: YearData, profile: Profile) -> Optional[str]:
+        try:
+            profiled(profile, provider.draw, data)
+        except Exception as e:  # pylint: disable=broad-except
+            return format_error(e)
+        return None
+
+    def draw_pool(self, collected: List[Collected]) -> Dict[str, Optional[str]]:
+        pool = self.pool()
+        pending: List[Tuple[Task, multiprocessing.pool.AsyncResult]] = []
+        for task, _, data in collected:
+            pending.append((task, pool.apply_async(draw_spec, (*task.spec(), data, self.timeout))))
+
+        # Workers enforce the per task timeout, this bound only catches workers that are stuck for good
+        end = None
+        if self.timeout:
+            end = time.monotonic() + self.timeout * (math.ceil(len(collected) / self.workers) + 1)
+
+        results = {}
+        for task, result in pending:
+            try:
+                results[task.task_hash()], profile = result.get(
+                    timeout=None if end is None else max(end - time.monotonic(), 0))
+                self.profiles[task.task_hash()].merge(profile)
+            except multiprocessing.TimeoutError:
+                results[task.task_hash()] = "TimeoutError: worker did not respond"
+                self.terminate()
+                break
+        for task, _ in pending:
+            results.setdefault(task.task_hash(), "Cancelled: worker pool was restarted")
+        return results
@@ -0,0 +1,108 @@
+import math
+from typing import List
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from yearmaps.impl.heatmap import Heatmap, LABEL_COLOR, YEAR_COLOR, SANS_SERIF
+from yearmaps.utils.palette import Palette
+
+# Layout in points, following the proportions of the matplotlib figure
+CELL = 10.5
+GAP = 1
+FONT_SIZE = 10
+TITLE_SIZE = 30
+YEAR_SIZE = 28
+# Advance of a monospace glyph relative to font size
+MONO_ADVANCE = 0.6
+COLOR_BAR_OFFSET = 10.8
+COLOR_BAR_WIDTH = 10.8
+PAD = 7.2
+
+MONOSPACE = "DejaVu Sans Mono, Menlo, Consolas, monospace"
+SANS = ", ".join(SANS_SERIF + ["DejaVu Sans", "sans-serif"])
+
+SVG_TEMPLATE = ('<?xml version="1.0" encoding="utf-8" standalone="no"?>\n'
+                '<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+                'width="{width}pt" height="{height}pt" viewBox="{x} {y} {width} {height}">\n'
+                '<rect x="{x}" y="{y}" width="{width}" height="{height}" fill="#ffffff"/>\n'
+                '{body}\n'
+                '</svg>\n')
+
+TEXT_TEMPLATE = '<text x="{x:.2f}" y="{y:.2f}" font-family="{family}" font-size="{size}"{attrs}>{text}</text>'
+
+
+def text(x: float, y: float, content: str, family: str = MONOSPACE, size: int = FONT_SIZE, **attrs) -> str:
+    extra = "".join(f' {key.replace("_", "-")}="{value}"' for key, value in attrs.items())
+    return TEXT_TEMPLATE.format(x=x, y=y, family=family, size=size, attrs=extra, text=escape(content))
+
+
+def text_width(content: str, size: float) -> float:
+    # Rough estimation, wide glyphs such as CJK take a full em
+    return sum(size if ord(c) > 0x2e80 else size * MONO_ADVANCE for c in content)
+
+
+def cells(heatmap: Heatmap) -> List[str]:
+    colors = heatmap.cell_colors()
+    days, weeks = np.nonzero(colors[..., 3] > 0)
+    fills = Palette.to_hex(colors[days, weeks])
+    size = CELL - GAP
+    return [f'<rect x="{w * CELL + GAP / 2:.2f}" y="{d * CELL + GAP / 2:.2f}" width="{size:.2f}" height="{size:.2f}" '
+            f'fill="{fill}"/>' for d, w, fill in zip(days, weeks, fills)]
+
+
+def color_bar(heatmap: Heatmap, left: float, height: float) -> List[str]:
+    lut = heatmap.palette.lut
+    band = height / len(lut)
+    ret = [f'<rect x="{left:.2f}" y="{height - (i + 1) * band:.2f}" width="{COLOR_BAR_WIDTH:.2f}" '
+           f'height="{band + 0.01:.2f}" fill="{fill}"/>'
+           for i, fill in enumerate(Palette.to_hex(lut))]
+    for value, label in heatmap.ticks:
+        y = height - heatmap.normalize(value) * height
+        ret.append(text(left + COLOR_BAR_WIDTH + 2, y, label, dominant_baseline="central"))
+    return ret
+
+
+def render_svg(heatmap: Heatmap) -> str:
+    width = heatmap.grid.weeks * CELL
+    height = 7 * CELL
+    body = cells(heatmap)
+
+    # weekdays label
+    for row, label in ((1, 'Tue'), (3, 'Thu'), (5, 'Sat')):
+        body.append(text(-2, (row + 0.5) * CELL, label, fill=LABEL_COLOR, text_anchor="end", dominant_baseline="central"))
+    left = -2 - text_width('Tue', FONT_SIZE)
+
+    # months label
+    for loc, label in heatmap.months:
+        body.append(text(loc * CELL, -4, label, text_anchor="middle"))
+
+    bottom = height
+    if heatmap.year_label is not None:
+        year_loc, year = heatmap.year_label
+        body.append(text(year_loc * CELL, height + 2 + FONT_SIZE, year))
+        bottom += 4 + FONT_SIZE
+
+    bar_left = width + COLOR_BAR_OFFSET
+    body.extend(color_bar(heatmap, bar_left, height))
+    right = bar_left + COLOR_BAR_WIDTH + 2 + max(text_width(label, FONT_SIZE) for _, label in heatmap.ticks)
+
+    # overall analysis
+    body.append(text(width, -0.25 * height - 2, heatmap.analysis, family=SANS, text_anchor="end"))
+
+    title_baseline = -4 - FONT_SIZE * 1.2 - 15
+    body.append(text(0, title_baseline, heatmap.title, family=SANS, size=TITLE_SIZE, font_weight="bold"))
+    top = min(title_baseline - TITLE_SIZE * 0.8, -0.25 * height - 2 - FONT_SIZE)
+
+    # year analysis on the left
+    if heatmap.side_label is not None:
+        x, y = -0.075 * width, 0.4 * height
+        body.append(text(x, y, heatmap.side_label, family=SANS, size=YEAR_SIZE, fill=YEAR_COLOR, font_weight="bold",
+                         text_anchor="middle", dominant_baseline="central", transform=f"rotate(-90 {x:.2f} {y:.2f})"))
+        left = min(left, x - YEAR_SIZE * 0.6)
+        top = min(top, y - text_width(heatmap.side_label, YEAR_SIZE) / 2)
+
+    # Whole units avoid a blurred edge around the background
+    left, top = math.floor(left - PAD), math.floor(top - PAD)
+    right, bottom = math.ceil(right + PAD), math.ceil(bottom + PAD)
+    return SVG_TEMPLATE.format(x=left, y=top, width=right - left, height=bottom - top, body="\n".join(body))
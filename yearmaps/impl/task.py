@@ -1,12 +1,15 @@
 from copy import deepcopy
-from datetime import date
+from datetime import date, datetime
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
 import click
 
 from yearmaps.constant import Configs
-from yearmaps.utils.util import dict_hash, str_hash
+from yearmaps.interface.provider import ProviderInterface
+from yearmaps.provider import get_provider, registry
+from yearmaps.utils.colors import color_list
+from yearmaps.utils.util import dict_hash, option_name, str_hash
 
 
 class Task:
@@ -15,21 +18,39 @@ class Task:
                  context: click.Context,
                  command: click.Command,
                  global_options: Dict,
-                 options: Dict):
+                 options: Dict,
+                 interval: Optional[float] = None):
         self.name = name
         self.command = command
         self.command_options = options
+        # Seconds between refreshes, not part of the hash as it never changes the output
+        self.interval = interval or get_provider(command.name).refresh_interval
         self.context = deepcopy(context)
         self.global_config: Configs = self.context.obj
         for key, value in global_options.items():
             setattr(self.global_config, key, value)
+        self.output_dir = Path(self.global_config.output)
         self.global_config.output = str(Path(
             self.global_config.output) / f"{self.task_hash()}.{self.global_config.file_type}")
 
-    def run(self, force=False):
-        if self.should_run() or force:
-            self.context.invoke(self.command, **self.command_options)
+    # Arguments of the provider factory, with defaults filled in like click does
+    def provider_options(self) -> Dict:
+        options = {}
+        for param in self.command.params:
+            if param.name in self.command_options:
+                options[param.name] = self.command_options[param.name]
+            else:
+                options[param.name] = param.get_default(self.context)
+        return options
 
+    def provider(self) -> ProviderInterface:
+        return get_provider(self.command.name).create(**self.provider_options())
+
+    # Picklable description of the task for pool workers
+    def spec(self) -> Tuple[str, Configs, Dict]:
+        return self.command.name, self.global_config, self.provider_options()
+
+    # Whether refreshing can change the output, the scheduler drops tasks that say no
     def should_run(self) -> bool:
         if self.context.obj.mode == 'year':
             return date.today().year == self.global_config.year
@@ -41,16 +62,103 @@ class Task:
         return str_hash(command_options_hash, global_options_hash, self.command.name)
 
     def cache_path(self) -> Path:
+        if self.global_config.filename is not None:
+            return Path(self.global_config.output) / self.global_config.filename
         return Path(self.global_config.output)
 
+    # Write the output to a named file of the output dir, instead of the file named by the task hash
+    def write_to(self, filename: str):
+        self.global_config.output = str(self.output_dir)
+        self.global_config.filename = filename
+
     def task_name(self) -> str:
         return f"{self.command.name} {self.command_options} {self.global_config} \n{self.task_hash()}"
 
-    def update_cache(self):
-        click.echo(f"Updating cache for {self.global_config} {self.command_options}")
-        self.run(force=True)
 
-    def ensure_cache(self, quiet=False):
-        if not quiet:
-            click.echo(f"Ensuring cache for {self.global_config} {self.command_options}")
-        self.run(force=True)
+# Additional check for global config
+def check_global_option(configs: Configs, key: str, value):
+    if not hasattr(configs, key):
+        raise KeyError(f'{key} is not a valid global option.')
+
+    if key == 'mode':
+        if value not in ['till_now', 'year']:
+            raise ValueError(f'{value} is not a valid mode.')
+    elif key == 'year':
+        if not isinstance(value, int):
+            raise TypeError('Year must be an integer.')
+        if value < 2000 or value > datetime.now().year:
+            raise ValueError(f'{value} is not a valid year.')
+    elif key == 'file_type':
+        if value not in ['png', 'svg']:
+            raise ValueError(f'{value} is not a supported file type.')
+    elif key == 'renderer':
+        if value not in ['native', 'matplotlib']:
+            raise ValueError(f'{value} is not a valid renderer.')
+    elif key == 'scale':
+        if not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f'{value} is not a valid scale.')
+    elif key == 'color':
+        if not isinstance(value, str):
+            raise TypeError('Color must be a string.')
+        if value not in color_list:
+            raise ValueError(f'{value} is not a valid color.')
+
+
+def check_refresh(value):
+    if not isinstance(value, (int, float)) or value <= 0:
+        raise ValueError('Refresh must be a positive number of seconds.')
+
+
+def command_option_map(command: click.Command, option: str) -> str:
+    for param in command.params:
+        if option == param.name:
+            return option
+        for opt in param.opts:
+            if option_name(opt) == option:
+                return param.name
+    raise ValueError(f'Option not found: {option}')
+
+
+def build_task(ctx: click.Context, provider_key: str, provider_config: Dict,
+               interval: Optional[float] = None) -> Task:
+    provider = get_provider(provider_key)
+    command: click.Command = provider.command
+    provider_config = dict(provider_config)
+
+    global_config = {}
+    if 'global' in provider_config.keys():
+        if not isinstance(provider_config['global'], Dict):
+            raise TypeError('Global config must be a dict.')
+        for key, value in provider_config.pop('global').items():
+            check_global_option(ctx.obj, key, value)
+            global_config[key] = value
+
+    if 'refresh' in provider_config.keys():
+        interval = provider_config.pop('refresh')
+        check_refresh(interval)
+
+    options = {command_option_map(command, key): value for key, value in provider_config.items()}
+    required = {param.name for param in command.params if param.required}
+    if not required.issubset(options.keys()):
+        raise KeyError(f'Provider {provider_key} is missing required params: {required - set(options.keys())}')
+
+    return Task(provider.name, ctx, command, global_config, options, interval)
+
+
+# Tasks of a providers section of yearmaps.yml, a provider may hold a list of configs, one per user
+def build_tasks(ctx: click.Context, providers_config: Dict, interval: Optional[float] = None) -> List[Task]:
+    if not isinstance(providers_config, Dict):
+        raise TypeError('Providers must have arguments.')
+
+    for key, provider_config in providers_config.items():
+        if key not in registry:
+            raise KeyError(f'Provider not found: {key}')
+        for item in provider_config if isinstance(provider_config, list) else [provider_config]:
+            if not isinstance(item, Dict):
+                raise TypeError(f'Provider {key} must be a dict.')
+
+    tasks = []
+    for key, provider_config in providers_config.items():
+        for item in provider_config if isinstance(provider_config, list) else [provider_config]:
+            tasks.append(build_task(ctx, key, item, interval))
+    return tasks
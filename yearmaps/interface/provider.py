@@ -3,13 +3,19 @@ import json
 from abc import ABC, abstractmethod
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, List, Callable, Union, Dict
+from typing import Any, List, Callable, Union, Dict, Optional, Sequence
 
 import click
 import numpy as np
+import requests
 
 from yearmaps.constant import Configs
-from yearmaps.utils import YearData
+from yearmaps.utils import YearData, http
+from yearmaps.utils.cache import ResponseCache
+from yearmaps.utils.file import atomic_write
+from yearmaps.utils.lock import file_lock
+from yearmaps.utils.storage import SeriesStore, open_store
+from yearmaps.utils.util import str_hash
 
 
 class ProviderInfo(ABC):
@@ -50,6 +56,17 @@ class ProviderInfo(ABC):
     def color(self) -> List[str]:
         pass
 
+    # Seconds a cached response is used without asking upstream, None never caches
+    http_ttl: Optional[float] = None
+
+    # Seconds between refreshes of the server
+    refresh_interval: float = 3 * 60 * 60
+
+    # User the data belongs to, keys the data files
+    @property
+    def identity(self) -> str:
+        return ""
+
     # Global group options
     options: Configs = None
 
@@ -68,6 +85,12 @@ class ProviderInterface(ABC):
     def init(self):
         pass
 
+    # Build the provider for the options of its command
+    @staticmethod
+    @abstractmethod
+    def create(**options) -> 'ProviderInterface':
+        pass
+
     # Register command to click
     @staticmethod
     @abstractmethod
@@ -76,26 +99,55 @@ class ProviderInterface(ABC):
 
 
 class ProviderUtils(ProviderInfo, ABC):
+    # Data file of the provider user, tasks of other users never share it
+    def data_file_path(self) -> Path:
+        return Path(self.options.data_dir) / f"{self.id}-{str_hash(str(self.identity))}.json"
+
     # Read cache
-    def __read_data_file(self) -> Dict:
-        data_file = Path(self.options.data_dir) / f"{self.id}.json"
+    def __read_data_file(self, data_file: Path) -> Dict:
+        if not data_file.exists():
+            # Earlier versions kept one file for every user of a provider
+            data_file = Path(self.options.data_dir) / f"{self.id}.json"
         if not data_file.exists():
             return {}
         with open(data_file, "r", encoding='UTF-8') as f:
             data = json.load(f)
         return data
 
-    # Write cache
-    def __write_data_file(self, cache: Any):
-        cache_file = Path(self.options.data_dir) / f"{self.id}.json"
-        with open(cache_file, "w", encoding='UTF-8') as f:
-            json.dump(cache, f)
+    # Write cache, owner only as it may hold tokens
+    @staticmethod
+    def __write_data_file(cache_file: Path, cache: Any):
+        atomic_write(cache_file, json.dumps(cache), mode=0o600)
 
+    # The file is locked until the block ends, and only written when it ends without error
     @contextmanager
     def data_file(self):
-        data = self.__read_data_file()
-        yield data
-        self.__write_data_file(data)
+        path = self.data_file_path()
+        with file_lock(path):
+            data = self.__read_data_file(path)
+            yield data
+            self.__write_data_file(path, data)
+
+    # Per-day history of the provider kept in the data dir
+    def series(self, name: str, columns: Sequence[str]) -> SeriesStore:
+        path = Path(self.options.data_dir) / "series" / f"{self.id}-{str_hash(str(self.identity))}-{name}"
+        return open_store(self.options.storage, path, columns)
+
+    # Send a request on the connections shared by all providers.
+    # With cache set, a successful response is kept in the data dir and reused for http_ttl seconds,
+    # valid tells apart the successful responses of upstreams reporting errors with a 200.
+    def request(self, method: str, url: str, cache: bool = False,
+                valid: Optional[Callable[[requests.Response], bool]] = None, **kwargs) -> requests.Response:
+        if not cache or self.http_ttl is None:
+            return http.session().request(method, url, **kwargs)
+        return ResponseCache(self.options.data_dir).request(http.session(), method, url, self.http_ttl, valid,
+                                                            **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
 
     # Judge a date should be rendered or not.
     def is_date_valid(self, date: datetime.date):
@@ -1,92 +1,102 @@
+import math
 from abc import ABC
+from collections import defaultdict
 from datetime import datetime
-from typing import Any
+from typing import Any, Dict
 
 import click
-import requests
 
 from yearmaps.impl.provider import Provider
 from yearmaps.utils import YearData
 from yearmaps.utils.colors import orange
 from yearmaps.utils.error import ProviderError
+from yearmaps.utils.storage import SeriesStore
 
 ENDPOINT_URL = "https://learnywhere.cn/bb/dashboard/profile/search?userId={user_id}"
 
+COLUMNS = ("time", "learn", "review")
+
 
 class BBDCProvider(Provider, ABC):
     name = "不背单词"
     id = "bbdc"
     color = orange
+    http_ttl = 30 * 60
 
     def __init__(self, uid: str):
         self.uid = uid
 
+    @property
+    def identity(self) -> str:
+        return str(self.uid)
+
+    @staticmethod
+    def create(uid: str, gtype: str) -> 'BBDCProvider':
+        if gtype == 'time':
+            return BBDCTimeProvider(uid)
+        if gtype == "word":
+            return BBDCWordProvider(uid)
+        raise ProviderError(f"Unknown type {gtype}")
+
     @staticmethod
     @click.command('bbdc', help="不背单词")
     @click.option('--id', '-i', 'uid', type=str, required=True, help='不背单词用户 ID')
     @click.option('--type', '-t', 'gtype', type=click.Choice(['time', 'word']), default='time', help='图数据类型')
     @click.pass_context
     def command(ctx: click.Context, uid: str, gtype: str):
-        if gtype == 'time':
-            provider = BBDCTimeProvider(uid)
-        elif gtype == "word":
-            provider = BBDCWordProvider(uid)
-        else:
-            raise ProviderError(f"Unknown type {gtype}")
-        provider.render(ctx.obj)
+        BBDCProvider.create(uid, gtype).render(ctx.obj)
 
     def access(self):
-
         """
-            data structure
-            id: user-id
-            utils:
-              2021-1-1:
-                learn: 20
-                time: 5
-                review: 20
+            series columns, one row a day
+            time: minutes learning
+            learn: new words
+            review: reviewed words
         """
+        store = self.series("daily", COLUMNS)
+        if store.empty():
+            self.import_data_file(store)
+
+        resp = self.get(ENDPOINT_URL.format(user_id=self.uid), cache=True)
+        if not resp.ok:
+            raise ProviderError(f"Meet network error. {resp.reason}")
+        resp_data = resp.json()
+        if resp_data["result_code"] != 200:
+            raise ProviderError(f"Unexpected error. {resp_data}")
+
+        body = resp_data["data_body"]
+        duration = body["durationList"]
+        learn = body["learnList"]
+
+        def today_transform(date):
+            if date == "今日":
+                return datetime.today().date()
+            return datetime.strptime(f"{datetime.today().year}-{date}", "%Y-%m-%d").date()
+
+        # Only the recent days the dashboard reports are written
+        rows = defaultdict(dict)
+        for i in duration:
+            rows[today_transform(i["date"])]["time"] = i["duration"]
+
+        for i in learn:
+            row = rows[today_transform(i["date"])]
+            row["learn"] = i["learnNum"]
+            row["review"] = i["reviewNum"]
+
+        store.write(rows)
+        return store.read(self.start_date(), self.end_date())
+
+    # Move the days earlier versions kept in the json data file
+    def import_data_file(self, store: SeriesStore):
         with self.data_file() as data:
-            if not data:
-                data = {
-                    "id": self.uid,
-                    "utils": {}
-                }
             if data.get("id") != self.uid:
-                raise ProviderError("user_id 和数据缓存不一致")
-            resp = requests.get(ENDPOINT_URL.format(user_id=self.uid))
-            if not resp.ok:
-                raise ProviderError(f"Meet network error. {resp.reason}")
-            resp_data = resp.json()
-            if resp_data["result_code"] != 200:
-                raise ProviderError(f"Unexpected error. {data}")
-
-            body = resp_data["data_body"]
-            duration = body["durationList"]
-            learn = body["learnList"]
-
-            def today_transform(date):
-                if date == "今日":
-                    return datetime.today().strftime("%Y-%m-%d")
-                return f"{datetime.today().year}-{date}"
-
-            for i in duration:
-                full_date = today_transform(i["date"])
-                if full_date not in data["utils"]:
-                    data["utils"][full_date] = {}
-                dur = i["duration"]
-                data["utils"][full_date]["time"] = dur
-
-            for i in learn:
-                full_date = today_transform(i["date"])
-                if full_date not in data["utils"]:
-                    data["utils"][full_date] = {}
-                learn = i["learnNum"]
-                review = i["reviewNum"]
-                data["utils"][full_date]["learn"] = learn
-                data["utils"][full_date]["review"] = review
-
-        return data
+                return
+            store.write({datetime.strptime(date, "%Y-%m-%d").date(): day_data
+                         for date, day_data in data.get("utils", {}).items()})
+
+
+def value(row: Dict[str, float], column: str) -> int:
+    return 0 if math.isnan(row[column]) else int(row[column])
 
 
 class BBDCTimeProvider(BBDCProvider):
@@ -94,11 +104,8 @@ class BBDCTimeProvider(BBDCProvider):
 
     def process(self, raw: Any) -> YearData:
         result = {}
-        for date, day_data in raw['utils'].items():
-            date = datetime.strptime(date, "%Y-%m-%d").date()
-            if self.is_date_valid(date):
-                time = day_data.get('time', 0)
-                result[date] = time
+        for date, row in raw.items():
+            result[date] = value(row, 'time')
         return result
 
 
@@ -107,10 +114,6 @@ class BBDCWordProvider(BBDCProvider):
 
     def process(self, raw: Any) -> YearData:
         result = {}
-        for date, day_data in raw['utils'].items():
-            date = datetime.strptime(date, "%Y-%m-%d").date()
-            if self.is_date_valid(date):
-                learn: int = day_data.get('learn', 0)
-                review: int = day_data.get('review', 0)
-                result[date] = learn + review
+        for date, row in raw.items():
+            result[date] = value(row, 'learn') + value(row, 'review')
         return result
@@ -1,50 +1,137 @@
+import contextvars
+import math
+import time
 from abc import ABC
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-from typing import Any
+from typing import Any, Dict, List
 
 import click
 import requests
 
 from yearmaps.impl.provider import Provider
-from yearmaps.utils import YearData
+from yearmaps.utils import YearData, http
 from yearmaps.utils.colors import pink
 from yearmaps.utils.error import ProviderError
 
 ENDPOINT_URL = "https://api.bilibili.com/x/space/arc/search?mid={uid}&ps=50&pn={pn}"
 
+# Bilibili answers with these when requests come too fast
+THROTTLE_STATUS = (412, 429)
+THROTTLE_CODES = (-412, -509, -799)
+RETRIES = 4
+# Seconds before the first retry, doubled on every later one
+BACKOFF = 1
+
+# Throttling is retried by fetch_page, the shared session only retries server errors
+http.retry_policy("https://api.bilibili.com/",
+                  status_forcelist=tuple(status for status in http.RETRY_STATUS if status not in THROTTLE_STATUS))
+
+
+# Throttling and other errors come with a 200, only bodies holding data are cached
+def is_data(resp: requests.Response) -> bool:
+    try:
+        return resp.json().get("code") == 0
+    except ValueError:
+        return False
+
 
 class BilibiliProvider(Provider, ABC):
     name = "bilibili"
     id = "bili"
     color = pink
+    http_ttl = 10 * 60
 
-    def __init__(self, uid: str):
+    def __init__(self, uid: str, concurrency: int = 4):
         self.uid = uid
+        self.concurrency = concurrency
 
-    def access(self) -> Any:
-        data_ret = []
-        pn = 1
-        data_tmp = requests.get(ENDPOINT_URL.format(uid=self.uid, pn=pn)).json()
-        ps = data_tmp["data"]["page"]["ps"]
-        cnt = data_tmp["data"]["page"]["count"]
-        while (pn - 1) * ps <= cnt:
-            data_ret.extend(data_tmp["data"]["list"]["vlist"])
+    @property
+    def identity(self) -> str:
+        return str(self.uid)
+
+    def fetch_page(self, pn: int) -> Dict:
+        for attempt in range(RETRIES + 1):
+            if attempt:
+                time.sleep(BACKOFF * 2 ** (attempt - 1))
+            resp = self.get(ENDPOINT_URL.format(uid=self.uid, pn=pn), cache=True, valid=is_data)
+            if resp.status_code in THROTTLE_STATUS:
+                continue
+            if not resp.ok:
+                raise ProviderError(f"Meet network error. {resp.reason}")
+            body = resp.json()
+            if body["code"] in THROTTLE_CODES:
+                continue
+            if body["code"] != 0:
+                raise ProviderError(f"Unexpected error. {body.get('message')}")
+            return body["data"]
+        raise ProviderError(f"Still throttled after {RETRIES} retries on page {pn}")
+
+    def fetch_pages(self, pns: range) -> List[Dict]:
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # Each page runs in a copy of the caller context, so it is profiled with its task
+            futures = [executor.submit(contextvars.copy_context().run, self.fetch_page, pn) for pn in pns]
+            return [future.result() for future in futures]
+
+    # Videos newer than the watermark, the api lists the newest videos first
+    def fetch_since(self, first: Dict, watermark: int, new: int) -> List[Dict]:
+        ps = first["page"]["ps"]
+        pages = math.ceil(first["page"]["count"] / ps)
+        # The change of count tells about how many pages hold new videos, fetch them at once
+        guess = min(max(math.ceil(new / ps), 1), pages)
+        results = [first] + self.fetch_pages(range(2, guess + 1))
+        pn = guess
+        while pn < pages and all(v["created"] > watermark for v in results[-1]["list"]["vlist"]):
             pn += 1
-            data_tmp = requests.get(ENDPOINT_URL.format(uid=self.uid, pn=pn)).json()
-        return data_ret
+            results.append(self.fetch_page(pn))
+        return [v for result in results for v in result["list"]["vlist"] if v["created"] > watermark]
+
+    def access(self) -> Any:
+        """
+            data structure
+            {uid}:
+              watermark: created time of the newest counted video
+              count: videos of the uploader at the last run
+              days:
+                2021-01-01: 2
+        """
+        with self.data_file() as data:
+            first = self.fetch_page(1)
+            count = first["page"]["count"]
+            state = data.get(str(self.uid))
+            if state is None or count < state["count"]:
+                # Unknown uploader, or videos were deleted and days can not be told, count everything again
+                state = {"watermark": 0, "count": 0, "days": {}}
+                pages = math.ceil(count / first["page"]["ps"])
+                videos = [v for result in [first] + self.fetch_pages(range(2, pages + 1))
+                          for v in result["list"]["vlist"]]
+            else:
+                videos = self.fetch_since(first, state["watermark"], count - state["count"])
+
+            for video in videos:
+                day = date.fromtimestamp(video["created"]).isoformat()
+                state["days"][day] = state["days"].get(day, 0) + 1
+                state["watermark"] = max(state["watermark"], video["created"])
+            state["count"] = count
+            data[str(self.uid)] = state
+            return state["days"]
+
+    @staticmethod
+    def create(uid: str, gtype: str, concurrency: int) -> 'BilibiliProvider':
+        if gtype == "video":
+            return BilibiliVideoProvider(uid, concurrency)
+        raise ProviderError(f"Unknown type {gtype}")
 
     @staticmethod
     @click.command("bili", help="Bilibili")
     @click.option("--id", "-i", "uid", type=str, required=True, help="bilibili uid")
     @click.option("--type", "-t", "gtype", type=click.Choice(("video",)), default="video", help="图数据类型")
+    @click.option("--concurrency", "-c", type=click.IntRange(min=1), default=4, show_default=True,
+                  help="同时请求的页数")
     @click.pass_context
-    def command(ctx: click.Context, uid: str, gtype: str):
-        if gtype == "video":
-            provider = BilibiliVideoProvider(uid)
-        else:
-            raise ProviderError(f"Unknown type {gtype}")
-        provider.render(ctx.obj)
+    def command(ctx: click.Context, uid: str, gtype: str, concurrency: int):
+        BilibiliProvider.create(uid, gtype, concurrency).render(ctx.obj)
 
 
 class BilibiliVideoProvider(BilibiliProvider):
@@ -52,6 +139,6 @@ class BilibiliVideoProvider(BilibiliProvider):
 
     def process(self, raw: Any) -> YearData:
         d = defaultdict(int)
-        for res in raw:
-            d[date.fromtimestamp(res["created"])] += 1
+        for day, count in raw.items():
+            d[date.fromisoformat(day)] += count
         return d
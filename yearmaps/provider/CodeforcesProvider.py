@@ -1,29 +1,110 @@
 from abc import ABC
 from collections import defaultdict
 from datetime import date
-from typing import Any
+from typing import Any, Dict, List, Tuple
 
 import click
-import requests
 
 from yearmaps.impl.provider import Provider
 from yearmaps.utils import YearData
 from yearmaps.utils.colors import purple
 from yearmaps.utils.error import ProviderError
 
-ENDPOINT_URL = "https://codeforces.com/api/user.status?handle={user}"
+ENDPOINT_URL = "https://codeforces.com/api/user.status"
+
+# Submissions asked for by the first request, doubled on every later one
+FIRST_PAGE = 50
+MAX_PAGE = 2000
+# Verdicts that can still change, submissions in queue have none
+PENDING_VERDICTS = (None, "TESTING")
 
 
 class CodeforcesProvider(Provider, ABC):
     name = "Codeforces"
     id = "cf"
     color = purple
+    http_ttl = 10 * 60
+    refresh_interval = 60 * 60
 
     def __init__(self, user: str):
         self.user = user
 
+    @property
+    def identity(self) -> str:
+        return str(self.user)
+
+    def fetch(self, start: int, count: int) -> List[Dict]:
+        resp = self.get(ENDPOINT_URL, params={"handle": self.user, "from": start, "count": count}, cache=True)
+        body = resp.json()
+        if body["status"] != "OK":
+            raise ProviderError(f"Unexpected error. {body.get('comment')}")
+        return body["result"]
+
+    # Submissions newer than last_id and not older than until, newest first.
+    # Also tells whether the whole history has been read.
+    def fetch_since(self, last_id: int, until: date) -> Tuple[List[Dict], bool]:
+        submissions = {}
+        start, count = 1, FIRST_PAGE
+        while True:
+            page = self.fetch(start, count)
+            for submission in page:
+                # New submissions shift the pages, so the same one may come twice
+                submissions.setdefault(submission["id"], submission)
+            if len(page) < count:
+                return list(submissions.values()), True
+            oldest = page[-1]
+            if oldest["id"] <= last_id or date.fromtimestamp(oldest["creationTimeSeconds"]) < until:
+                return list(submissions.values()), False
+            start += count
+            count = min(count * 2, MAX_PAGE)
+
     def access(self) -> Any:
-        return requests.get(ENDPOINT_URL.format(user=self.user)).json()
+        """
+            data structure
+            {user}:
+              last_id: newest counted submission
+              since: first day with complete counts
+              days:
+                2021-01-01:
+                  all: 3
+                  ac: 1
+        """
+        with self.data_file() as data:
+            state = data.get(self.user)
+            start_date = self.start_date()
+            if state is None or start_date < date.fromisoformat(state["since"]):
+                # Nothing known about this window yet, read back to its start
+                submissions, exhausted = self.fetch_since(0, start_date)
+                state = {
+                    "last_id": 0,
+                    "since": date.min.isoformat() if exhausted else start_date.isoformat(),
+                    "days": {}
+                }
+            else:
+                submissions, _ = self.fetch_since(state["last_id"], date.min)
+
+            # Stop before the first submission still being judged, it is read again next time
+            pending = [s["id"] for s in submissions if s.get("verdict") in PENDING_VERDICTS]
+            horizon = min(pending, default=float("inf"))
+            for submission in submissions:
+                if not state["last_id"] < submission["id"] < horizon:
+                    continue
+                day = date.fromtimestamp(submission["creationTimeSeconds"]).isoformat()
+                counts = state["days"].setdefault(day, {"all": 0, "ac": 0})
+                counts["all"] += 1
+                if submission["verdict"] == "OK":
+                    counts["ac"] += 1
+            state["last_id"] = max([state["last_id"]] + [s["id"] for s in submissions if s["id"] < horizon])
+            data[self.user] = state
+            return state["days"]
+
+    @staticmethod
+    def create(user: str, gtype: str) -> 'CodeforcesProvider':
+        if gtype == "all":
+            return CodeforcesAllProvider(user)
+        if gtype == "ac":
+            return CodeforcesACProvider(user)
+        raise ProviderError(f"Unknown type {gtype}")
 
     @staticmethod
     @click.command("cf", help="Codeforces")
@@ -31,13 +112,7 @@ class CodeforcesProvider(Provider, ABC):
     @click.option("--type", "-t", "gtype", type=click.Choice(("all", "ac")), default="all", help="图数据类型")
     @click.pass_context
     def command(ctx: click.Context, user: str, gtype: str):
-        if gtype == "all":
-            provider = CodeforcesAllProvider(user)
-        elif gtype == "ac":
-            provider = CodeforcesACProvider(user)
-        else:
-            raise ProviderError(f"Unknown type {gtype}")
-        provider.render(ctx.obj)
+        CodeforcesProvider.create(user, gtype).render(ctx.obj)
 
 
 class CodeforcesACProvider(CodeforcesProvider):
@@ -45,9 +120,8 @@ class CodeforcesACProvider(CodeforcesProvider):
 
     def process(self, raw: Any) -> YearData:
         d = defaultdict(int)
-        for res in raw["result"]:
-            if res["verdict"] == "OK":
-                d[date.fromtimestamp(res["creationTimeSeconds"])] += 1
+        for day, counts in raw.items():
+            d[date.fromisoformat(day)] += counts["ac"]
         return d
 
 
@@ -56,6 +130,6 @@ class CodeforcesAllProvider(CodeforcesProvider):
 
     def process(self, raw: Any) -> YearData:
         d = defaultdict(int)
-        for res in raw["result"]:
-            d[date.fromtimestamp(res["creationTimeSeconds"])] += 1
+        for day, counts in raw.items():
+            d[date.fromisoformat(day)] += counts["all"]
         return d
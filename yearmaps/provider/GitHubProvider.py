@@ -3,7 +3,6 @@ from datetime import datetime
 from typing import Any
 
 import click
-import requests
 
 from yearmaps.impl.provider import Provider
 from yearmaps.utils import YearData
@@ -34,11 +33,26 @@ class GitHubProvider(Provider, ABC):
     id = "github"
     name = "GitHub"
     color = blue
+    refresh_interval = 60 * 60
+    # GraphQL answers carry no ETag or Last-Modified to revalidate with. The ttl stays below the
+    # shortest jittered wait between scheduled refreshes, so every one of them asks GitHub, and
+    # runs in between, such as the command line, restarts or on demand renders, reuse the answer.
+    http_ttl = 45 * 60
 
     def __init__(self, user: str, token: str):
         self.user = user
         self.token = token
 
+    @property
+    def identity(self) -> str:
+        return str(self.user)
+
+    @staticmethod
+    def create(user: str, token: str, gtype: str) -> 'GitHubProvider':
+        if gtype == 'contrib':
+            return GitHubContribProvider(user, token)
+        raise ProviderError(f"Unknown type {gtype}")
+
     @staticmethod
     @click.command('github', help="GitHub")
     @click.option('--user', '-u', type=str, required=True, help="GitHub user name")
@@ -46,18 +60,14 @@ class GitHubProvider(Provider, ABC):
     @click.option('--type', '-t', 'gtype', type=click.Choice(['contrib']), default='contrib', help="图数据类型")
     @click.pass_context
     def command(ctx: click.Context, user: str, gtype: str, token: str):
-        if gtype == 'contrib':
-            provider = GitHubContribProvider(user, token)
-        else:
-            raise ProviderError(f"Unknown type {gtype}")
-        provider.render(ctx.obj)
+        GitHubProvider.create(user, token, gtype).render(ctx.obj)
 
 
 class GitHubContribProvider(GitHubProvider):
     unit = "Contribution"
 
     def access(self) -> Any:
-        resp = requests.post(ENDPOINT_URL, json={
+        resp = self.post(ENDPOINT_URL, json={
             'query': contribution_query,
             'variables': {
                 'user': self.user,
@@ -65,7 +75,7 @@ class GitHubContribProvider(GitHubProvider):
             }
         }, headers={
             'Authorization': f"bearer {self.token}"
-        })
+        }, cache=True)
         if not resp.ok:
             raise ProviderError(f"{resp.status_code} - {resp.reason}")
         return resp.json()
@@ -7,8 +7,6 @@ from urllib.parse import urlparse, parse_qs
 
 import click
 import numpy as np
-import requests
-import requests.utils
 
 from yearmaps.impl.provider import Provider
 from yearmaps.utils import YearData
@@ -20,6 +18,8 @@ class MiFitProvider(Provider, ABC):
     id = 'mifit'
     name = '小米运动'
     color = indigo
+    http_ttl = 60 * 60
+    refresh_interval = 6 * 60 * 60
 
     def __init__(self, phone: str, password: str):
         self.phone = phone
@@ -28,9 +28,14 @@ class MiFitProvider(Provider, ABC):
         self.app_token = None
         self.up_token = None
 
+    @property
+    def identity(self) -> str:
+        return str(self.phone)
+
     def init(self):
         with self.data_file() as data:
-            if "user_id" in data and "up_token" in data:
+            # Files of earlier versions were shared by all users, their tokens may belong to another phone
+            if data.get("phone") == self.phone and "user_id" in data and "up_token" in data:
                 self.user_id = data["user_id"]
                 self.up_token = data["up_token"]
                 try:
@@ -41,9 +46,16 @@ class MiFitProvider(Provider, ABC):
                         raise e
             self.login_with_password(self.phone, self.password)
             self.login_with_token()
+            data["phone"] = self.phone
             data["user_id"] = self.user_id
             data["up_token"] = self.up_token
 
+    @staticmethod
+    def create(phone: str, password: str, gtype: str) -> 'MiFitProvider':
+        if gtype == 'sleep':
+            return MiFitSleepProvider(phone, password)
+        raise ProviderError(f"Unsupported type {gtype}")
+
     @staticmethod
     @click.command('mifit', help='小米运动')
     @click.option('--phone', '-u', type=str, required=True, help='手机号（华米健康）')
@@ -51,11 +63,7 @@ class MiFitProvider(Provider, ABC):
     @click.option('--type', '-t', 'gtype', type=click.Choice(['sleep']), default='sleep', help='图数据类型')
     @click.pass_context
     def command(ctx: click.Context, phone: str, password: str, gtype: str):
-        if gtype == 'sleep':
-            provider = MiFitSleepProvider(phone, password)
-        else:
-            raise ProviderError(f"Unsupported type {gtype}")
-        provider.render(ctx.obj)
+        MiFitProvider.create(phone, password, gtype).render(ctx.obj)
 
     def login_with_password(self, phone: str, password: str):
         req_data = (
@@ -68,8 +76,8 @@ class MiFitProvider(Provider, ABC):
             ("token", "refresh"),
             ("redirect_uri", "https://s3-us-west-2.amazonaws.com/hm-registration/successsignin.html"),
         )
-        resp = requests.post(f"https://api-user.huami.com/registrations/%2B86{phone}/tokens", data=req_data,
-                             allow_redirects=False)
+        resp = self.post(f"https://api-user.huami.com/registrations/%2B86{phone}/tokens", data=req_data,
+                         allow_redirects=False)
         if not resp.ok:
             raise ProviderError(f"Login failed {resp.status_code} {resp.reason}")
         location = resp.headers["Location"]
@@ -92,7 +100,7 @@ class MiFitProvider(Provider, ABC):
             "source": "com.xiaomi.hm.health:4.0.17:50283",
             "lang": "zh"
         }
-        resp = requests.post("https://account.huami.com/v2/client/login", data=req_data)
+        resp = self.post("https://account.huami.com/v2/client/login", data=req_data)
         if not resp.ok:
             err = ProviderError(f"Login failed {resp.status_code} {resp.reason}")
             err.status_code = resp.status_code
@@ -142,7 +150,8 @@ class MiFitSleepProvider(MiFitProvider):
             "from_date": self.start_date().strftime("%Y-%m-%d"),
             "to_date": self.end_date().strftime("%Y-%m-%d"),
         }
-        resp = requests.get("https://api-mifit.huami.com/v1/data/band_data.json", headers=headers, params=params)
+        resp = self.get("https://api-mifit.huami.com/v1/data/band_data.json", headers=headers, params=params,
+                        cache=True)
         if not resp.ok:
             raise ProviderError(f"Access failed {resp.status_code} {resp.reason}")
         return resp.json()
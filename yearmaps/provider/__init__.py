@@ -1,9 +1,40 @@
-from yearmaps.provider.BBDCProvider import BBDCProvider
-from yearmaps.provider.BilibiliProvider import BilibiliProvider
-from yearmaps.provider.CodeforcesProvider import CodeforcesProvider
-from yearmaps.provider.GitHubProvider import GitHubProvider
-from yearmaps.provider.MiFitProvider import MiFitProvider
+import importlib
+from typing import TYPE_CHECKING, Dict, List, Tuple, Type
 
-providers = [BBDCProvider, BilibiliProvider, CodeforcesProvider, GitHubProvider, MiFitProvider]
+if TYPE_CHECKING:
+    from yearmaps.impl.provider import Provider
 
-provider_map = {x.command.name: x for x in providers}
+    # Resolved by __getattr__ below, declared for type checkers and linters
+    providers: List[Type[Provider]]
+    provider_map: Dict[str, Type[Provider]]
+
+# Command name to the module of its provider and the help of its command,
+# so commands are listed without importing any provider
+registry: Dict[str, Tuple[str, str]] = {
+    'bbdc': ('BBDCProvider', '不背单词'),
+    'bili': ('BilibiliProvider', 'Bilibili'),
+    'cf': ('CodeforcesProvider', 'Codeforces'),
+    'github': ('GitHubProvider', 'GitHub'),
+    'mifit': ('MiFitProvider', '小米运动'),
+}
+
+
+# Import the provider of a command, leaving the other providers alone
+def get_provider(name: str):
+    module_name, _ = registry[name]
+    provider = getattr(importlib.import_module(f"{__name__}.{module_name}"), module_name)
+    # Importing the module binds its name here, the class is what this package exports
+    globals()[module_name] = provider
+    return provider
+
+
+# providers, provider_map and the provider classes import on first access
+def __getattr__(name: str):
+    if name == 'providers':
+        return [get_provider(command) for command in registry]
+    if name == 'provider_map':
+        return {command: get_provider(command) for command in registry}
+    for command, (module_name, _) in registry.items():
+        if module_name == name:
+            return get_provider(command)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
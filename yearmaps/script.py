@@ -1,14 +1,49 @@
 import os
+import re
+from collections import Counter
+from typing import List
 
 import click
 
 from yearmaps.constant import Configs
-from yearmaps.provider import providers
+from yearmaps.provider import get_provider, registry
 from yearmaps.utils.colors import color_list
 from yearmaps.utils.file import default_data_dir
 
 
-@click.group()
+class LazyGroup(click.Group):
+    """
+    Group listing the providers from the registry, a provider is only
+    imported when its command runs.
+    """
+
+    def list_commands(self, ctx: click.Context):
+        return sorted(set(registry) | set(super().list_commands(ctx)))
+
+    def get_command(self, ctx: click.Context, cmd_name: str):
+        command = super().get_command(ctx, cmd_name)
+        if command is None and cmd_name in registry:
+            command = get_provider(cmd_name).command
+        return command
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter):
+        names = self.list_commands(ctx)
+        if not names:
+            return
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = []
+        for name in names:
+            if name in registry and name not in self.commands:
+                rows.append((name, registry[name][1]))
+                continue
+            command = self.get_command(ctx, name)
+            if command is not None and not command.hidden:
+                rows.append((name, command.get_short_help_str(limit)))
+        with formatter.section('Commands'):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup)
 @click.option('--data-dir', '-d', default=str(default_data_dir()), type=str, show_default=True,
               help='Directory to store datas')
 @click.option('--output-dir', '-o', default=os.getcwd(), type=str, show_default=True,
@@ -21,9 +56,16 @@ from yearmaps.utils.file import default_data_dir
               help='Year to generate, this option will override mode to "year"')
 @click.option('--color', '-c', type=click.Choice(color_list.keys()),
               help='Color to override provider default color')
+@click.option('--renderer', '-r', default='native', type=click.Choice(['native', 'matplotlib']), show_default=True,
+              help='Rendering backend')
+@click.option('--scale', '-s', type=float, help='Pixels per point of png output from the native renderer')
+@click.option('--storage', default='memmap', type=click.Choice(['memmap', 'sqlite']), show_default=True,
+              help='Storage of per-day history in the data directory')
 @click.pass_context
-def cli(ctx: click.Context, data_dir: str, output_dir: str, file_type: str, mode: str, year: int, color: str):
-    ctx.obj = Configs(data_dir=data_dir, output=output_dir, mode=mode, file_type=file_type, color=color)
+def cli(ctx: click.Context, data_dir: str, output_dir: str, file_type: str, mode: str, year: int, color: str,
+        renderer: str, scale: float, storage: str):
+    ctx.obj = Configs(data_dir=data_dir, output=output_dir, mode=mode, file_type=file_type, color=color,
+                      renderer=renderer, scale=scale, storage=storage)
     obj = ctx.obj
     if mode == 'year':
         if year is None:
@@ -35,9 +77,46 @@ def cli(ctx: click.Context, data_dir: str, output_dir: str, file_type: str, mode
     click.echo("Selecting provider.")
 
 
+# {id}.{file_type} with the user of the task appended, tasks that still collide get their hash as well
+def output_names(tasks: List) -> List[str]:
+    names = []
+    for task in tasks:
+        provider = task.provider()
+        identity = re.sub(r'[^\w.-]', '_', str(provider.identity))
+        names.append(f"{provider.id}-{identity}" if identity else provider.id)
+    counts = Counter(names)
+    return [f"{name}-{task.task_hash()[:8]}.{task.global_config.file_type}" if counts[name] > 1
+            else f"{name}.{task.global_config.file_type}" for name, task in zip(names, tasks)]
+
+
+@cli.command('batch', help='Render every provider and user of a manifest')
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Tasks fetching data at the same time')
+@click.pass_context
+def batch(ctx: click.Context, manifest: str, jobs: int):
+    import yaml
+    from yearmaps.impl.scheduler import Refresher
+    from yearmaps.impl.task import build_tasks
+    from yearmaps.utils import http
+
+    # Same shape as the providers section of yearmaps.yml, a provider may list one config per user
+    with open(manifest, 'r', encoding='UTF-8') as f:
+        tasks = build_tasks(ctx, yaml.load(f, Loader=yaml.FullLoader))
+    for task, name in zip(tasks, output_names(tasks)):
+        task.write_to(name)
+
+    # All tasks share the process, its connection pool and the loaded renderers
+    http.configure(pool_size=max(http.POOL_SIZE, jobs))
+    results = Refresher(fetchers=jobs).refresh(tasks, quiet=True)
+    for task in tasks:
+        if results.get(task.task_hash()) is None:
+            click.echo(f"Saved {task.cache_path()}")
+    if any(results.values()):
+        ctx.exit(1)
+
+
 def main():
-    for provider in providers:
-        cli.add_command(provider.command)
     cli()
 
 
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import threading
 import time
@@ -7,18 +8,65 @@ from typing import Dict, List
 
 import click
 import indexpy
-import schedule
+import requests
 import uvicorn
 import yaml
 from indexpy import request
 
 from yearmaps.constant import Configs
-from yearmaps.impl.task import Task
-from yearmaps.provider import providers, provider_map
-from yearmaps.utils import file
-from yearmaps.utils.colors import color_list
+from yearmaps.impl.assets import Asset, AssetStore
+from yearmaps.impl.ondemand import OVERRIDES, OnDemandRenderer
+from yearmaps.impl.scheduler import Refresher, RefreshQueue, TaskState
+from yearmaps.impl.task import Task, build_tasks, check_global_option, check_refresh
+from yearmaps.utils import file, http
+from yearmaps.utils.cache import TaskManifest
+from yearmaps.utils.error import ProviderError
 from yearmaps.utils.file import ensure_dir
-from yearmaps.utils.util import option_name, update_time, get_update_time
+from yearmaps.utils.metrics import CONTENT_TYPE, HTTP_DURATION, HTTP_REQUESTS, Gauge, registry
+from yearmaps.utils.storage import stores
+from yearmaps.utils.util import update_time, get_update_time
+
+# Cache lifetime of images no longer refreshed
+IMMUTABLE_MAX_AGE = 24 * 60 * 60
+# Cache lifetime of images about to be replaced by a running refresh
+REFRESHING_MAX_AGE = 30
+
+
+# Overrides of the on demand renderer from query parameters
+def parse_overrides(configs: Configs, query) -> Dict:
+    overrides = {}
+    for key in OVERRIDES:
+        value = query.get(key)
+        if value is None:
+            continue
+        if key == 'year':
+            value = int(value)
+        check_global_option(configs, key, value)
+        overrides[key] = value
+    return overrides
+
+
+# Route of a path as labelled in the request metrics, so paths do not grow the label set
+def route_kind(path: str, tasks_hash_table: Dict[str, Task]) -> str:
+    if path in ('index.html', 'api', 'update_time', 'timings', 'metrics'):
+        return path.split('.')[0]
+    if path in tasks_hash_table:
+        return 'task'
+    if path.startswith('api/render/'):
+        return 'render'
+    return 'static'
+
+
+def asset_response(asset: Asset, max_age: int):
+    encoding, body, etag = asset.select(request.headers.get('accept-encoding'))
+    headers = {'ETag': etag, 'Cache-Control': f'public, max-age={max_age}'}
+    if asset.variants:
+        headers['Vary'] = 'Accept-Encoding'
+    if asset.matches(request.headers.get('if-none-match'), etag):
+        return indexpy.HttpResponse(status_code=304, headers=headers)
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return indexpy.PlainTextResponse(body, headers=headers, media_type=asset.media_type)
 
 
 @click.command()
@@ -52,6 +100,44 @@ def cli(ctx: click.Context, host: str, port: int, config: str):
         config_dict['year'] = datetime.now().year
     if 'file_type' not in config_dict.keys():
         config_dict['file_type'] = 'png'
+    if 'renderer' not in config_dict.keys():
+        config_dict['renderer'] = 'native'
+    if 'workers' not in config_dict.keys():
+        config_dict['workers'] = 1
+    if 'timeout' not in config_dict.keys():
+        config_dict['timeout'] = 300
+    if 'fetchers' not in config_dict.keys():
+        config_dict['fetchers'] = 8
+    if 'http-timeout' not in config_dict.keys():
+        config_dict['http-timeout'] = 60
+    if 'http-retries' not in config_dict.keys():
+        config_dict['http-retries'] = 3
+    if 'storage' not in config_dict.keys():
+        config_dict['storage'] = 'memmap'
+    if 'render-cache-size' not in config_dict.keys():
+        config_dict['render-cache-size'] = 64
+
+    if not isinstance(config_dict['workers'], int) or config_dict['workers'] < 1:
+        raise ValueError('Workers must be a positive integer.')
+    if not isinstance(config_dict['fetchers'], int) or config_dict['fetchers'] < 1:
+        raise ValueError('Fetchers must be a positive integer.')
+    if not isinstance(config_dict['http-timeout'], (int, float)) or config_dict['http-timeout'] <= 0:
+        raise ValueError('Http timeout must be a positive number of seconds.')
+    if not isinstance(config_dict['http-retries'], int) or config_dict['http-retries'] < 0:
+        raise ValueError('Http retries must be a non-negative integer.')
+    if 'refresh' in config_dict.keys():
+        check_refresh(config_dict['refresh'])
+    if not isinstance(config_dict['render-cache-size'], (int, float)) or config_dict['render-cache-size'] <= 0:
+        raise ValueError('Render cache size must be a positive number of megabytes.')
+    if config_dict['storage'] not in stores:
+        raise ValueError(f"{config_dict['storage']} is not a valid storage.")
+    if config_dict['timeout'] is not None and (
+            not isinstance(config_dict['timeout'], (int, float)) or config_dict['timeout'] <= 0):
+        raise ValueError('Timeout must be a positive number of seconds.')
+
+    # Providers share one connection pool for the whole life of the server
+    http.configure(timeout=config_dict['http-timeout'], retries=config_dict['http-retries'],
+                   pool_size=max(http.POOL_SIZE, config_dict['fetchers']))
 
     # Check dirs
     config_dict['data-dir'] = ensure_dir(config_dict['data-dir'])
@@ -64,7 +150,10 @@ def cli(ctx: click.Context, host: str, port: int, config: str):
         mode=config_dict['mode'],
         year=config_dict.get('year', None),
         file_type=config_dict['file_type'],
-        color=config_dict.get('color', None)
+        color=config_dict.get('color', None),
+        renderer=config_dict['renderer'],
+        scale=config_dict.get('scale', None),
+        storage=config_dict['storage']
     )
     ctx.obj.server = True
 
@@ -72,122 +161,97 @@ def cli(ctx: click.Context, host: str, port: int, config: str):
     if 'providers' not in config_dict.keys():
         raise KeyError('Providers not found in config file.')
 
-    if not isinstance(config_dict['providers'], Dict):
-        raise TypeError('Providers must have arguments.')
-
-    # Build required params for each provider
-    provider_required_params = {}
-    for provider in providers:
-        command: click.Command = provider.command
-        params = command.params
-        name = command.name
-        provider_required_params[name] = []
-        for param in params:
-            if param.required:
-                provider_required_params[name].append(param.name)
-
-    # Validate provider config
-    for key in config_dict['providers'].keys():
-        if key not in provider_required_params:
-            raise KeyError(f'Provider not found: {key}')
-
-        provider_config = config_dict['providers'][key]
-        if not isinstance(provider_config, Dict):
-            raise TypeError(f'Provider {key} must be a dict.')
-
-    def command_option_map(com: click.Command, option: str) -> str:
-        for par in com.params:
-            if option == par.name:
-                return option
-            for opt in par.opts:
-                if option_name(opt) == option:
-                    return par.name
-        raise ValueError(f'Option not found: {option}')
-
-    # Build tasks
-    task_list: List[Task] = []
-    for provider_key, provider_config in config_dict['providers'].items():
-        global_config = {}
-
-        provider = provider_map[provider_key]
-        command = provider.command
-        name = provider.name
-
-        if 'global' in provider_config.keys():
-            if not isinstance(provider_config['global'], Dict):
-                raise TypeError('Global config must be a dict.')
-            for key, value in provider_config['global'].items():
-                # Additional check for global config
-                if not hasattr(ctx.obj, key):
-                    raise KeyError(f'{key} is not a valid global option.')
-
-                if key == 'mode':
-                    if value not in ['till_now', 'year']:
-                        raise ValueError(f'{value} is not a valid mode.')
-                elif key == 'year':
-                    if not isinstance(value, int):
-                        raise TypeError('Year must be an integer.')
-                    if value < 2000 or value > datetime.now().year:
-                        raise ValueError(f'{value} is not a valid year.')
-                elif key == 'file_type':
-                    if value not in ['png', 'svg']:
-                        raise ValueError(f'{value} is not a supported file type.')
-                elif key == 'color':
-                    if not isinstance(value, str):
-                        raise TypeError('Color must be a string.')
-                    if value not in color_list:
-                        raise ValueError(f'{value} is not a valid color.')
-
-                global_config[key] = value
-                provider_config.pop('global')
-
-        replace_keys = []
-        for key, value in provider_config.items():
-            mapped_option = command_option_map(command, key)
-            if key != mapped_option:
-                replace_keys.append((key, mapped_option))
-        for old, new in replace_keys:
-            provider_config[new] = provider_config.pop(old)
-
-        if not set(provider_config.keys()).issuperset(set(provider_required_params[provider_key])):
-            raise KeyError(
-                'Provider {key} is missing required params: '
-                f'{set(provider_required_params[provider_key]) - set(provider_config.keys())}')
-
-        task_list.append(Task(name, ctx, command, global_config, provider_config))
+    task_list: List[Task] = build_tasks(ctx, config_dict['providers'], config_dict.get('refresh', None))
 
     def call_update_time():
         update_time(ctx.obj.output)
 
+    refresher = Refresher(workers=config_dict['workers'], timeout=config_dict['timeout'],
+                          fetchers=config_dict['fetchers'])
+
+    # Build tasks hash table
+    tasks_hash_table = {}
+    for task in task_list:
+        click.echo(f'Valid task: {task.task_name()}')
+        tasks_hash_table[task.task_hash()] = task
+
+    assets = AssetStore()
+    # Final outputs of tasks that can not change, skipped across restarts
+    manifest = TaskManifest(ctx.obj.output)
+    renderer = OnDemandRenderer(int(config_dict['render-cache-size'] * 1024 * 1024))
+
+    # Load finished outputs into memory, requests are served from there
+    def publish():
+        for task_item in task_list:
+            if assets.load(task_item.task_hash(), task_item.cache_path()) is not None:
+                refresher.states.found(task_item.task_hash(),
+                                       manifest.is_done(task_item.task_hash(), task_item.cache_path()))
+        renderer.reset(tasks_hash_table, refresher.data)
+
+    # Outputs left by the last run are served until the first refresh ends
+    publish()
+
     def ensure_cache():
-        for queue_task in task_list:
-            queue_task.ensure_cache(quiet=True)
+        refresher.refresh_pending(task_list, manifest, quiet=True)
+        publish()
         call_update_time()
 
     threading.Thread(target=ensure_cache).start()
 
+    queue = RefreshQueue()
+    for task_item in task_list:
+        queue.push(task_item)
+
     def update_cache():
-        for queue_task in task_list:
-            queue_task.update_cache()
+        refresher.refresh_due(queue, manifest)
+        publish()
         call_update_time()
 
-    schedule.every(3).hours.do(update_cache)
-
     def loop():
         while True:
-            wait_time = schedule.idle_seconds()
-            time.sleep(wait_time)
-            schedule.run_pending()
+            wait_time = queue.idle_seconds()
+            # Nothing is left to refresh once every task is immutable
+            time.sleep(60 if wait_time is None else max(wait_time, 0))
+            update_cache()
+
+    # The image can not change before the next refresh of its task
+    def max_age(task_hash: str) -> int:
+        if refresher.states.get(task_hash).state == TaskState.RENDERING:
+            return REFRESHING_MAX_AGE
+        next_run = queue.next_run(task_hash)
+        if next_run is None:
+            return REFRESHING_MAX_AGE if tasks_hash_table[task_hash].should_run() else IMMUTABLE_MAX_AGE
+        return max(int(next_run - time.time()), 0)
 
     regen = threading.Thread(target=loop)
     regen.daemon = True
     regen.start()
 
-    # Build tasks hash table
-    tasks_hash_table = {}
-    for task in task_list:
-        click.echo(f'Valid task: {task.task_name()}')
-        tasks_hash_table[task.task_hash()] = task
+    # Series of the task gauges, read at every scrape
+    def last_success():
+        ret = {}
+        for task_hash, task_item in tasks_hash_table.items():
+            succeeded = refresher.states.get(task_hash).succeeded
+            if succeeded is not None:
+                ret[(task_hash, task_item.command.name)] = succeeded
+        return ret
+
+    def task_states():
+        ret = {}
+        for task_hash, task_item in tasks_hash_table.items():
+            current = refresher.states.get(task_hash).state
+            for state in TaskState:
+                ret[(task_hash, task_item.command.name, state.value)] = int(state == current)
+        return ret
+
+    registry.register(Gauge('yearmaps_task_last_success_timestamp_seconds',
+                            'Unix time of the last successful refresh of a task.', ['task', 'provider'], last_success))
+    registry.register(Gauge('yearmaps_task_state', 'Current state of a task, 1 for the state it is in.',
+                            ['task', 'provider', 'state'], task_states))
+    registry.register(Gauge('yearmaps_refresh_queue_depth', 'Tasks scheduled for a refresh.',
+                            function=lambda: {(): len(queue)}))
+    registry.register(Gauge('yearmaps_refresh_queue_overdue', 'Scheduled tasks whose refresh is past due.',
+                            function=lambda: {(): queue.overdue()}))
 
     @app.router.http('/', name='index')
     @app.router.http('/{path:any}', name='route')
@@ -197,17 +261,57 @@ def cli(ctx: click.Context, host: str, port: int, config: str):
         else:
             path = 'index.html'
 
+        start = time.perf_counter()
+        response = await respond(path)
+        route = route_kind(path, tasks_hash_table)
+        HTTP_REQUESTS.inc(route=route, status=str(response.status_code))
+        HTTP_DURATION.observe(time.perf_counter() - start, route=route)
+        return response
+
+    async def respond(path: str):
         if path == 'api':
             ret = []
             for task_hash, task_item in tasks_hash_table.items():
-                ret.append((task_item.command.name, task_item.name, task_hash))
+                state = refresher.states.get(task_hash).state
+                ret.append((task_item.command.name, task_item.name, task_hash, state.value))
             return indexpy.JSONResponse(ret)
 
         if path == 'update_time':
             return indexpy.JSONResponse(get_update_time(ctx.obj.output))
 
+        # Per stage timings of the last refresh of every task, with histograms over recent refreshes
+        if path == 'timings':
+            return indexpy.JSONResponse(refresher.timings.summary())
+
+        # Prometheus text format
+        if path == 'metrics':
+            return indexpy.PlainTextResponse(registry.exposition(), media_type=CONTENT_TYPE)
+
         if path in tasks_hash_table:
-            return indexpy.FileResponse(filepath=str(tasks_hash_table[path].cache_path()))
+            # The last good image is served while the task refreshes or after it failed
+            asset = assets.get(path)
+            if asset is None:
+                if refresher.states.get(path).state in (TaskState.NEVER_RENDERED, TaskState.RENDERING):
+                    return indexpy.HttpResponse(status_code=503, headers={'Retry-After': str(REFRESHING_MAX_AGE)})
+                return indexpy.HttpResponse(status_code=404)
+            return asset_response(asset, max_age(path))
+
+        if path.startswith('api/render/'):
+            task_item = tasks_hash_table.get(path[len('api/render/'):])
+            if task_item is None:
+                return indexpy.HttpResponse(status_code=404)
+            try:
+                overrides = parse_overrides(ctx.obj, request.query_params)
+            except (KeyError, TypeError, ValueError) as e:
+                return indexpy.JSONResponse({'error': str(e)}, status_code=400)
+            try:
+                asset = await asyncio.get_running_loop().run_in_executor(None, renderer.render, task_item, overrides)
+            except (ProviderError, requests.RequestException) as e:
+                return indexpy.JSONResponse({'error': str(e)}, status_code=502)
+            except ValueError as e:
+                # Nothing to draw in the requested window, such as a year before any data
+                return indexpy.JSONResponse({'error': str(e)}, status_code=404)
+            return asset_response(asset, max_age(task_item.task_hash()))
 
         static_file = Path(__file__).parent / "static" / path
         if static_file.is_file():
@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import requests
+
+from yearmaps.utils import YearData
+from yearmaps.utils.file import atomic_write
+from yearmaps.utils.metrics import CACHE_REQUESTS
+from yearmaps.utils.util import dict_hash, str_hash
+
+# Bump when renderers change so existing outputs are drawn again
+RENDER_VERSION = "1"
+
+
+def data_hash(data: YearData) -> str:
+    items = sorted((d.isoformat(), v) for d, v in data.items())
+    return str_hash(json.dumps(items, default=float))
+
+
+class RenderCache:
+    """
+    Remembers the key of the data and options each output was rendered from.
+
+    Keys are kept under the data dir, one small file per output, so outputs
+    written by different tasks never share state.
+    """
+
+    def __init__(self, data_dir: Union[str, Path]):
+        self.dir = Path(data_dir) / "render"
+
+    def key_file(self, output: Path) -> Path:
+        return self.dir / f"{str_hash(str(Path(output).resolve()))}.key"
+
+    def is_fresh(self, output: Path, key: str) -> bool:
+        key_file = self.key_file(output)
+        if not Path(output).exists() or not key_file.exists():
+            return False
+        return key_file.read_text(encoding='UTF-8') == key
+
+    def store(self, output: Path, key: str):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.key_file(output), key)
+
+
+class TaskManifest:
+    """
+    Tasks whose output can never change again, such as a past year, and
+    the data they were rendered from.
+
+    Kept in the cache dir next to the outputs, so a restart does not
+    fetch and draw them again. Entries are keyed by the task hash, which
+    covers the configuration of the task, and remember the render
+    version, so changing either renders the task once more.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path]):
+        self.path = Path(cache_dir) / "manifest.json"
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Dict]:
+        if not self.path.exists():
+            return {}
+        try:
+            return json.loads(self.path.read_text(encoding='UTF-8'))
+        except ValueError:
+            return {}
+
+    def is_done(self, task_hash: str, output: Path) -> bool:
+        entry = self.load().get(task_hash)
+        return entry is not None and entry['render'] == RENDER_VERSION and Path(output).exists()
+
+    def record(self, task_hash: str, digest: Optional[str]):
+        with self._lock:
+            manifest = self.load()
+            manifest[task_hash] = {'data': digest, 'render': RENDER_VERSION, 'time': time.time()}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write(self.path, json.dumps(manifest, indent=2))
+
+
+class ResponseCache:
+    """
+    Keeps successful responses on disk and replays them.
+
+    A response younger than the ttl is used without asking upstream. An
+    older one is revalidated with its ETag or Last-Modified, and a 304
+    answer replays the stored body. Callers whose upstream reports errors
+    with a 200 pass valid, responses it rejects are never stored.
+    """
+
+    # Headers needed to revalidate and decode a stored body
+    KEPT_HEADERS = ('ETag', 'Last-Modified', 'Content-Type')
+    # Entries not used for this many seconds are removed
+    MAX_AGE = 7 * 24 * 3600
+
+    def __init__(self, data_dir: Union[str, Path]):
+        self.dir = Path(data_dir) / "http"
+
+    @staticmethod
+    def key(method: str, url: str, kwargs: Dict) -> str:
+        # Credentials are part of the request, so they are hashed in and never shared between users
+        return dict_hash({
+            'method': method.upper(),
+            'url': url,
+            'params': kwargs.get('params'),
+            'data': kwargs.get('data'),
+            'json': kwargs.get('json'),
+            'headers': kwargs.get('headers'),
+        })
+
+    def load(self, key: str) -> Optional[Tuple[Dict, bytes]]:
+        meta_file, body_file = self.dir / f"{key}.json", self.dir / f"{key}.body"
+        if not meta_file.exists() or not body_file.exists():
+            return None
+        return json.loads(meta_file.read_text(encoding='UTF-8')), body_file.read_bytes()
+
+    def store(self, key: str, meta: Dict, body: Optional[bytes] = None):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if body is not None:
+            atomic_write(self.dir / f"{key}.body", body)
+        atomic_write(self.dir / f"{key}.json", json.dumps(meta))
+
+    def prune(self):
+        deadline = time.time() - self.MAX_AGE
+        for meta_file in self.dir.glob("*.json"):
+            if meta_file.stat().st_mtime < deadline:
+                meta_file.unlink(missing_ok=True)
+                meta_file.with_suffix(".body").unlink(missing_ok=True)
+
+    @staticmethod
+    def replay(meta: Dict, body: bytes) -> requests.Response:
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.url = meta['url']
+        resp.headers.update(meta['headers'])
+        resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+        resp._content = body  # pylint: disable=protected-access
+        return resp
+
+    def request(self, session: requests.Session, method: str, url: str, ttl: float,
+                valid: Optional[Callable[[requests.Response], bool]] = None, **kwargs) -> requests.Response:
+        key = self.key(method, url, kwargs)
+        cached = self.load(key)
+        now = time.time()
+        if cached is not None and now - cached[0]['time'] < ttl:
+            CACHE_REQUESTS.inc(cache='response', result='hit')
+            return self.replay(*cached)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if cached is not None:
+            if 'ETag' in cached[0]['headers']:
+                headers['If-None-Match'] = cached[0]['headers']['ETag']
+            if 'Last-Modified' in cached[0]['headers']:
+                headers['If-Modified-Since'] = cached[0]['headers']['Last-Modified']
+        resp = session.request(method, url, headers=headers, **kwargs)
+
+        if resp.status_code == 304 and cached is not None:
+            CACHE_REQUESTS.inc(cache='response', result='revalidated')
+            meta, body = cached
+            meta['time'] = now
+            self.store(key, meta)
+            return self.replay(meta, body)
+        CACHE_REQUESTS.inc(cache='response', result='miss')
+        if resp.status_code == 200 and (valid is None or valid(resp)):
+            self.store(key, {
+                'url': resp.url,
+                'time': now,
+                'headers': {name: resp.headers[name] for name in self.KEPT_HEADERS if name in resp.headers},
+            }, resp.content)
+            self.prune()
+        return resp
@@ -1,56 +1,45 @@
-from typing import List
+from typing import List, Optional
 
-import click
 import numpy as np
-from matplotlib.colors import ListedColormap, to_rgba_array
+from matplotlib.colors import ListedColormap
 
-no_value_color = to_rgba_array("#f6f6f6")
+from yearmaps.utils.palette import Palette, build_palette
 
 
-class PolarisationColorMap(ListedColormap):
-    def __init__(self, colors: List[str], color_need: int, no_grey_index: List[int]):
-        colors = colors.copy()
-        self.zero_color = to_rgba_array(colors[0])
-        self.no_grey_index = no_grey_index
-        colors.pop(0)
-        if color_need != -1:
-            if color_need == 0:
-                colors = colors[:1]
-            else:
-                colors = colors[:color_need]
-        super().__init__(colors)
+class MaskedListedColorMap(ListedColormap):
+    def __init__(self, palette: Palette, padding: np.ndarray, zero: Optional[np.ndarray] = None):
+        self.palette = palette
+        self.padding = padding
+        self.zero = zero
+        super().__init__(palette.colors)
 
-    # noinspection PyShadowingBuiltins
-    def __call__(self, X, alpha=None, bytes=False):
-        if isinstance(X, np.ma.core.MaskedArray):
-            index = np.where(X == 0)
-            mask_index = np.where(X.mask)
-            color = super(ListedColormap, self).__call__(X, alpha=alpha, bytes=bytes)
-            for i in index:
-                color[i] = self.zero_color
-            for i in mask_index[0]:
-                if i in self.no_grey_index:
-                    continue
-                color[i] = no_value_color
-            return color
-        click.echo(f"Unhandled situation {type(X)}", err=True)
-        return super(ListedColormap, self).__call__(X, alpha=alpha, bytes=bytes)
-
-
-class WithBlankListedColorMap(ListedColormap):  # TODO: support color need
-    def __init__(self, colors: List[str], no_grey_index: List[int]):
-        self.no_grey_index = no_grey_index
-        super().__init__(colors)
+    def masks(self, X: np.ndarray):
+        # Grid masks only apply to the heatmap, the color bar is painted from its own values
+        if np.size(X) != self.padding.size:
+            return None, None
+        padding = self.padding.reshape(np.shape(X))
+        zero = None if self.zero is None else self.zero.reshape(np.shape(X))
+        return padding, zero
 
     # noinspection PyShadowingBuiltins
     def __call__(self, X, alpha=None, bytes=False):
-        if isinstance(X, np.ma.core.MaskedArray):
-            mask_index = np.where(X.mask)
-            color = super(ListedColormap, self).__call__(X, alpha=alpha, bytes=bytes)
-            for i in mask_index[0]:
-                if i in self.no_grey_index:
-                    continue
-                color[i] = no_value_color
-            return color
-        click.echo(f"Unhandled situation {type(X)}", err=True)
-        return super(ListedColormap, self).__call__(X, alpha=alpha, bytes=bytes)
+        scalar = np.ndim(X) == 0
+        if scalar:
+            X = np.ma.atleast_1d(X)
+        padding, zero = self.masks(X)
+        color = self.palette.paint(X, padding=padding, zero=zero, alpha=alpha)
+        if bytes:
+            color = (color * 255).astype(np.uint8)
+        if scalar:
+            return tuple(color[0])
+        return color
+
+
+class PolarisationColorMap(MaskedListedColorMap):
+    def __init__(self, colors: List[str], color_need: int, padding: np.ndarray, zero: np.ndarray):
+        super().__init__(build_palette(colors, color_need, True), padding, zero)
+
+
+class WithBlankListedColorMap(MaskedListedColorMap):
+    def __init__(self, colors: List[str], color_need: int, padding: np.ndarray):
+        super().__init__(build_palette(colors, color_need, False), padding)
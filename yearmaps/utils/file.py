@@ -1,6 +1,8 @@
+import os
+import stat
 import tempfile
 from pathlib import Path
-from typing import Union
+from typing import Optional, Union
 
 from yearmaps.utils.error import ProviderError
 
@@ -28,3 +30,32 @@ def default_data_dir() -> Path:
 
 def default_cache_dir() -> Path:
     return Path(tempfile.gettempdir()) / "yearmaps-cache"
+
+
+# Process umask, read once at import while no other thread can race on changing it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+# Write through a temp file renamed into place, readers see the old or the new content and never a part.
+# The file keeps the mode of the one it replaces, new files follow the umask unless mode is given.
+def atomic_write(path: Union[Path, str], content: Union[bytes, str], mode: Optional[int] = None):
+    path = Path(path)
+    data = content.encode('UTF-8') if isinstance(content, str) else content
+    if mode is None:
+        try:
+            mode = stat.S_IMODE(path.stat().st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~UMASK
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file readable by the owner only
+        os.chmod(temp, mode)
+        os.replace(temp, path)
+    except BaseException:
+        Path(temp).unlink(missing_ok=True)
+        raise
@@ -0,0 +1,80 @@
+import datetime
+from dataclasses import dataclass
+
+import numpy as np
+
+from yearmaps.utils import YearData
+
+# 1970-01-01 is a Thursday, shift day numbers so that Monday is 0
+EPOCH_WEEKDAY = 3
+
+
+@dataclass
+class Grid:
+    # 7 x weeks values, NaN when there is no data
+    values: np.ndarray
+    # 7 x weeks, True for cells outside the [start, end] range
+    padding: np.ndarray
+    # Month number of the Monday opening each week, -1 if the Monday is out of range
+    months: np.ndarray
+    # Year label and the week it is placed on
+    year: int
+    year_loc: int
+
+    @property
+    def weeks(self) -> int:
+        return self.values.shape[1]
+
+
+def to_day(d: datetime.date) -> np.datetime64:
+    return np.datetime64(d, 'D')
+
+
+def weekday(days: np.ndarray) -> np.ndarray:
+    return (days.astype('int64') + EPOCH_WEEKDAY) % 7
+
+
+def build_grid(data: YearData, start: datetime.date, end: datetime.date) -> Grid:
+    start_day = to_day(start)
+    end_day = to_day(end)
+
+    graph_start = start_day - weekday(start_day)
+    graph_end = end_day + (6 - weekday(end_day))
+    weeks = int((graph_end - graph_start).astype('int64')) // 7 + 1
+
+    start_off = int((start_day - graph_start).astype('int64'))
+    end_off = int((end_day - graph_start).astype('int64'))
+
+    # Day offset of every cell from graph_start, laid out as [weekday, week]
+    offsets = np.arange(weeks * 7).reshape(weeks, 7).T
+    padding = (offsets < start_off) | (offsets > end_off)
+
+    values = np.full((7, weeks), np.nan, dtype="float64")
+    if data:
+        days = np.fromiter(data.keys(), dtype='datetime64[D]', count=len(data))
+        counts = np.fromiter(data.values(), dtype="float64", count=len(data))
+        off = (days - graph_start).astype('int64')
+        valid = (off >= start_off) & (off <= end_off)
+        off = off[valid]
+        values[off % 7, off // 7] = counts[valid]
+
+    # Weeks whose Monday falls in range are labeled with that Monday's month
+    mondays = graph_start + np.arange(weeks) * 7
+    monday_off = np.arange(weeks) * 7
+    months = np.full(weeks, -1, dtype=int)
+    in_range = (monday_off >= start_off) & (monday_off <= end_off)
+    months[in_range] = mondays[in_range].astype('datetime64[M]').astype('int64') % 12 + 1
+
+    # The year label moves to the first Sunday of the latest year if the range crosses years
+    sundays = mondays + 6
+    sunday_off = monday_off + 6
+    sundays = sundays[(sunday_off >= start_off) & (sunday_off <= end_off)]
+    year, year_loc = start.year, start_off // 7
+    if sundays.size:
+        years = sundays.astype('datetime64[Y]').astype('int64') + 1970
+        if years[-1] != years[0]:
+            first = int(np.argmax(years == years[-1]))
+            year = int(years[-1])
+            year_loc = int((sundays[first] - graph_start).astype('int64')) // 7
+
+    return Grid(values=values, padding=padding, months=months, year=year, year_loc=year_loc)
@@ -0,0 +1,98 @@
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from yearmaps.utils import profile
+
+# Seconds to connect and to wait for the response
+DEFAULT_TIMEOUT = (10, 60)
+DEFAULT_RETRIES = 3
+# Sleep between retries is backoff * 2 ** (retry - 1) seconds
+BACKOFF_FACTOR = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Connections kept to every host, at least the number of tasks fetching at once
+POOL_SIZE = 16
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class Session(requests.Session):
+    """
+    Session applying a default timeout, retrying failed connections and
+    server errors of idempotent requests with backoff. Logins and other
+    POSTs are sent once.
+
+    Connections are pooled per host by the adapter, so requests to the same
+    upstream reuse the TCP and TLS connection across tasks.
+    """
+
+    def __init__(self, timeout: Optional[Timeout] = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                 pool_size: int = POOL_SIZE):
+        super().__init__()
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.retry = Retry(total=retries, backoff_factor=BACKOFF_FACTOR, status_forcelist=RETRY_STATUS,
+                           allowed_methods=Retry.DEFAULT_ALLOWED_METHODS, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=self.retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.hooks['response'].append(profile.record_response)
+        # Adapters of the registered retry policies, built on first use
+        self._policy_adapters: Dict[str, HTTPAdapter] = {}
+        self._policy_lock = threading.Lock()
+
+    def get_adapter(self, url):
+        for prefix, overrides in list(_policies.items()):
+            if url.lower().startswith(prefix.lower()):
+                with self._policy_lock:
+                    if prefix not in self._policy_adapters:
+                        self._policy_adapters[prefix] = HTTPAdapter(
+                            pool_connections=self.pool_size, pool_maxsize=self.pool_size,
+                            max_retries=self.retry.new(**overrides))
+                    return self._policy_adapters[prefix]
+        return super().get_adapter(url)
+
+    def close(self):
+        super().close()
+        with self._policy_lock:
+            for adapter in self._policy_adapters.values():
+                adapter.close()
+            self._policy_adapters.clear()
+
+    def request(self, method, url, *args, **kwargs):  # pylint: disable=arguments-differ
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, *args, **kwargs)
+
+
+_lock = threading.Lock()
+_session: Optional[Session] = None
+_options = {}
+# Url prefix to the Retry arguments its requests override
+_policies: Dict[str, Dict] = {}
+
+
+# Retry requests to an upstream differently, for providers handling some failures themselves
+def retry_policy(prefix: str, **overrides):
+    _policies[prefix] = overrides
+
+
+# Change how the shared session is built, takes effect on the next request
+def configure(**options):
+    global _session  # pylint: disable=global-statement
+    with _lock:
+        _options.update(options)
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+# The session shared by all providers of the process
+def session() -> Session:
+    global _session  # pylint: disable=global-statement
+    with _lock:
+        if _session is None:
+            _session = Session(**_options)
+        return _session
@@ -0,0 +1,48 @@
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Union
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_guard = threading.Lock()
+_locks: Dict[str, threading.Lock] = {}
+
+
+def thread_lock(path: Path) -> threading.Lock:
+    key = os.path.normcase(str(path.resolve()))
+    with _guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+@contextmanager
+def file_lock(path: Union[Path, str]):
+    """
+    Hold a file exclusively against other threads and processes.
+
+    The lock is taken on a `.lock` file next to it, so the file itself can
+    be replaced while held.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with thread_lock(path):
+        with open(path.with_name(f"{path.name}.lock"), "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,166 @@
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from yearmaps.utils.profile import BUCKETS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+# Upper bounds of request latency buckets in seconds
+REQUEST_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        pairs = ','.join(f'{key}="{escape(label)}"' for key, label in labels.items())
+        return f'{name}{{{pairs}}} {format_value(value)}'
+    return f'{name} {format_value(value)}'
+
+
+class Metric:
+    """
+    A metric family of the Prometheus text format, one series per
+    combination of label values.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def key(self, labels: Dict[str, str]) -> Labels:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, not {tuple(labels)}")
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self) -> Iterable[Sample]:
+        return []
+
+    def exposition(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines += [format_sample(*sample) for sample in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, dict(zip(self.labels, key)), value) for key, value in sorted(values.items())]
+
+
+class Gauge(Metric):
+    """
+    Gauge read from a function at every scrape, the function maps label
+    values to the value of their series.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 function: Optional[Callable[[], Dict[Labels, float]]] = None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def samples(self) -> Iterable[Sample]:
+        if self.function is None:
+            return []
+        return [(self.name, dict(zip(self.labels, key)), value) for key, value in sorted(self.function().items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # Per series, the count of each bucket that is not cumulative yet, the sum and the count
+        self._values: Dict[Labels, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * (len(self.buckets) + 1), 0, 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = counts, total + value, count + 1
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        ret = []
+        for key, (counts, total, count) in sorted(values.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket
+                ret.append((f'{self.name}_bucket', {**labels, 'le': format_value(bound)}, cumulative))
+            ret.append((f'{self.name}_sum', labels, total))
+            ret.append((f'{self.name}_count', labels, count))
+        return ret
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    # A metric registered again under the same name replaces the old one
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def exposition(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.exposition() for metric in metrics) + '\n'
+
+
+registry = Registry()
+
+REFRESH_DURATION = registry.register(Histogram(
+    'yearmaps_refresh_duration_seconds', 'Duration of refresh runs, fetching and rendering all their tasks.'))
+FETCH_DURATION = registry.register(Histogram(
+    'yearmaps_fetch_duration_seconds', 'Time to fetch and process the data of a task.', ['provider']))
+RENDER_DURATION = registry.register(Histogram(
+    'yearmaps_render_duration_seconds', 'Time to build, draw and save the image of a task.', ['provider']))
+FETCH_FAILURES = registry.register(Counter(
+    'yearmaps_fetch_failures_total', 'Tasks whose data could not be fetched.', ['provider']))
+RENDER_FAILURES = registry.register(Counter(
+    'yearmaps_render_failures_total', 'Tasks whose image could not be rendered.', ['provider']))
+CACHE_REQUESTS = registry.register(Counter(
+    'yearmaps_cache_requests_total', 'Lookups of the render, response and on demand caches.', ['cache', 'result']))
+HTTP_REQUESTS = registry.register(Counter(
+    'yearmaps_http_requests_total', 'Requests answered by the server.', ['route', 'status']))
+HTTP_DURATION = registry.register(Histogram(
+    'yearmaps_http_request_duration_seconds', 'Time to answer a request.', ['route'], REQUEST_BUCKETS))
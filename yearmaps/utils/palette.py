@@ -0,0 +1,80 @@
+from typing import List, Optional, Union
+
+import numpy as np
+
+NO_VALUE_COLOR = "#f6f6f6"
+TRANSPARENT = np.zeros(4)
+
+
+def hex_to_rgba(color: str) -> np.ndarray:
+    color = color.lstrip('#')
+    channels = [int(color[i:i + 2], 16) / 255 for i in range(0, len(color), 2)]
+    if len(channels) == 3:
+        channels.append(1.0)
+    return np.array(channels, dtype="float64")
+
+
+def select_colors(colors: List[str], color_need: int) -> List[str]:
+    # Keep one color per distinct value when there are fewer values than colors
+    if color_need == -1:
+        return list(colors)
+    return list(colors[:max(color_need, 1)])
+
+
+def build_palette(colors: List[str], color_need: int, polarised: bool) -> 'Palette':
+    if polarised:
+        # The first color is reserved for zero values
+        return Palette(select_colors(colors[1:], color_need), zero_color=colors[0])
+    return Palette(select_colors(colors, color_need))
+
+
+class Palette:
+    """
+    Maps normalized values to RGBA colors in one vectorized pass.
+
+    Cells flagged by ``padding`` are transparent, blank cells (NaN or masked) use
+    the no value color and cells flagged by ``zero`` use the zero color.
+    """
+
+    def __init__(self, colors: List[str], zero_color: Optional[str] = None):
+        self.colors = list(colors)
+        self.lut = np.array([hex_to_rgba(c) for c in self.colors])
+        self.zero_color = None if zero_color is None else hex_to_rgba(zero_color)
+        self.no_value_color = hex_to_rgba(NO_VALUE_COLOR)
+
+    @property
+    def N(self) -> int:
+        return len(self.lut)
+
+    def index(self, x: np.ndarray) -> np.ndarray:
+        if np.issubdtype(x.dtype, np.integer):
+            return np.clip(x, 0, self.N - 1)
+        scaled = np.nan_to_num(x, nan=0.0) * self.N
+        return np.clip(np.floor(scaled), 0, self.N - 1).astype(int)
+
+    def paint(self,
+              x: Union[np.ndarray, np.ma.MaskedArray],
+              padding: Optional[np.ndarray] = None,
+              zero: Optional[np.ndarray] = None,
+              alpha: Optional[float] = None) -> np.ndarray:
+        values = np.ma.getdata(x)
+        blank = np.ma.getmaskarray(x)
+        if np.issubdtype(values.dtype, np.floating):
+            blank = blank | np.isnan(values)
+
+        rgba = self.lut[self.index(values)]
+        if alpha is not None:
+            rgba[..., 3] = alpha
+        rgba[blank] = self.no_value_color
+        if self.zero_color is not None:
+            if zero is None:
+                zero = (values == 0) & ~blank
+            rgba[zero] = self.zero_color
+        if padding is not None:
+            rgba[padding] = TRANSPARENT
+        return rgba
+
+    @staticmethod
+    def to_hex(rgba: np.ndarray) -> List[str]:
+        channels = np.rint(np.asarray(rgba)[..., :3] * 255).astype(int).reshape(-1, 3)
+        return [f"#{r:02x}{g:02x}{b:02x}" for r, g, b in channels]
@@ -0,0 +1,160 @@
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Deque, Dict, List, Optional
+
+# Stages of a render, in order: fetch and process data, build the heatmap, draw it, write it
+STAGES = ('init', 'access', 'process', 'fulfill', 'draw', 'save')
+# Upper bounds of histogram buckets in seconds
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+# Samples of each stage the histograms are built from
+WINDOW = 100
+
+
+@dataclass
+class StageTiming:
+    wall: float = 0
+    cpu: float = 0
+
+
+@dataclass
+class Profile:
+    """
+    Time spent in each stage of one task, the bytes it fetched and the size
+    of its output. CPU time is that of the thread running the stage.
+    """
+    stages: Dict[str, StageTiming] = field(default_factory=dict)
+    fetched: int = 0
+    output: int = 0
+    # Unix time the profile was started at
+    started: float = field(default_factory=time.time)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    # The lock is not picklable, profiles come back from pool workers
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                timing = self.stages.setdefault(name, StageTiming())
+                timing.wall += time.perf_counter() - wall
+                timing.cpu += time.thread_time() - cpu
+
+    def add_fetched(self, size: int):
+        with self._lock:
+            self.fetched += size
+
+    def merge(self, other: 'Profile'):
+        with self._lock:
+            for name, timing in other.stages.items():
+                mine = self.stages.setdefault(name, StageTiming())
+                mine.wall += timing.wall
+                mine.cpu += timing.cpu
+            self.fetched += other.fetched
+            self.output = other.output or self.output
+
+    def as_dict(self) -> Dict:
+        return {
+            'stages': {name: asdict(self.stages[name]) for name in STAGES if name in self.stages},
+            'fetched': self.fetched,
+            'output': self.output,
+            'started': self.started,
+        }
+
+
+_current: 'ContextVar[Optional[Profile]]' = ContextVar('profile', default=None)
+
+
+def current() -> Optional[Profile]:
+    return _current.get()
+
+
+# Record into the profile while the block runs in this thread
+@contextmanager
+def activate(profile: Profile):
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+# Time a stage of the active profile, costs nothing when no profile is active
+@contextmanager
+def stage(name: str):
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    with profile.stage(name):
+        yield
+
+
+def record_output(size: int):
+    profile = _current.get()
+    if profile is not None:
+        profile.output = size
+
+
+# Response hook of the http session, counts the body of every response from upstream
+def record_response(response, *_args, **_kwargs):
+    profile = _current.get()
+    if profile is not None:
+        profile.add_fetched(len(response.content))
+
+
+class Timings:
+    """
+    Rolling histograms of the wall time of every stage, over the last
+    WINDOW profiles, with the last profile of every task.
+    """
+
+    def __init__(self, window: int = WINDOW):
+        self._samples: Dict[str, Deque[float]] = {name: deque(maxlen=window) for name in STAGES}
+        self._tasks: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def add(self, task_hash: str, provider: str, profile: Profile):
+        with self._lock:
+            for name, timing in profile.stages.items():
+                self._samples[name].append(timing.wall)
+            self._tasks[task_hash] = {'provider': provider, **profile.as_dict()}
+
+    @staticmethod
+    def histogram(samples: List[float]) -> Dict:
+        counts = [0] * (len(BUCKETS) + 1)
+        for sample in samples:
+            counts[bisect.bisect_left(BUCKETS, sample)] += 1
+        ordered = sorted(samples)
+        return {
+            'count': len(samples),
+            'sum': sum(samples),
+            'buckets': {**{str(bound): count for bound, count in zip(BUCKETS, counts)}, '+Inf': counts[-1]},
+            'p50': ordered[len(ordered) // 2] if ordered else None,
+            'p95': ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] if ordered else None,
+            'max': ordered[-1] if ordered else None,
+        }
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {
+                'stages': {name: self.histogram(list(samples)) for name, samples in self._samples.items()},
+                'tasks': dict(self._tasks),
+            }
@@ -0,0 +1,243 @@
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import closing
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from yearmaps.utils.file import atomic_write
+from yearmaps.utils.lock import file_lock
+
+Row = Dict[str, float]
+Rows = Dict[date, Row]
+
+
+class SeriesStore(ABC):
+    """
+    Numeric columns holding one value per day.
+
+    Writing a day only replaces the given columns of that day, so adding
+    the few days an upstream reports costs the same however long the
+    history is. Values never written read as NaN.
+    """
+
+    def __init__(self, path: Union[str, Path], columns: Sequence[str]):
+        self.path = Path(path)
+        self.columns = list(columns)
+
+    @abstractmethod
+    def write(self, rows: Rows):
+        pass
+
+    # Days between start and end, both included, that have any value
+    @abstractmethod
+    def read(self, start: date, end: date) -> Rows:
+        pass
+
+    @abstractmethod
+    def empty(self) -> bool:
+        pass
+
+    def check_columns(self, rows: Rows):
+        for row in rows.values():
+            unknown = set(row) - set(self.columns)
+            if unknown:
+                raise KeyError(f"Unknown columns {unknown} of {self.path}")
+
+
+class MemmapSeriesStore(SeriesStore):
+    """
+    Fixed width float64 rows in a flat file, the row of a day is its
+    offset from the first stored day.
+
+    Reads and writes map the file, so only the pages of the touched days
+    are loaded. The first day, the columns and the name of the data file
+    are kept in a json sidecar. Moving the first day writes the rows to a
+    new data file and the sidecar last, so the rows and the day they
+    start at change together.
+    """
+
+    def __init__(self, path: Union[str, Path], columns: Sequence[str]):
+        super().__init__(path, columns)
+        self.meta_path = self.path.with_suffix(".json")
+        # Data files are replaced on rebase, writers lock this stable path instead
+        self.lock_path = self.path.with_suffix(".f8")
+
+    @property
+    def width(self) -> int:
+        return len(self.columns)
+
+    def meta(self) -> Optional[Dict]:
+        if not self.meta_path.exists():
+            return None
+        meta = json.loads(self.meta_path.read_text(encoding='UTF-8'))
+        if meta["columns"] != self.columns:
+            raise ValueError(f"{self.path} holds columns {meta['columns']}, not {self.columns}")
+        return meta
+
+    # The first day and the data file holding the rows from it, from one read of the sidecar
+    def snapshot(self) -> Tuple[Optional[date], Path]:
+        meta = self.meta()
+        # Stores of earlier versions kept one data file without a name in the sidecar
+        if meta is None or "data" not in meta:
+            data_path = self.path.with_suffix(".f8")
+        else:
+            data_path = self.path.with_name(meta["data"])
+        return (None if meta is None else date.fromisoformat(meta["origin"])), data_path
+
+    def origin(self) -> Optional[date]:
+        return self.snapshot()[0]
+
+    def length(self, data_path: Path) -> int:
+        if not data_path.exists():
+            return 0
+        return data_path.stat().st_size // (8 * self.width)
+
+    # Rows with the first day they start at. Readers take no lock, so a rebase may replace the data
+    # file between reading the sidecar and opening the file, the new sidecar is read then.
+    def load(self) -> Tuple[Optional[date], np.ndarray]:
+        snapshot = self.snapshot()
+        while True:
+            origin, data_path = snapshot
+            if origin is None:
+                return None, np.empty((0, self.width))
+            try:
+                with open(data_path, "rb") as f:
+                    length = os.fstat(f.fileno()).st_size // (8 * self.width)
+                    if length == 0:
+                        return origin, np.empty((0, self.width))
+                    # The map keeps the file readable after it is closed or unlinked
+                    return origin, np.memmap(f, dtype=np.float64, mode='r', shape=(length, self.width))
+            except FileNotFoundError:
+                current = self.snapshot()
+                if current == snapshot:
+                    return origin, np.empty((0, self.width))
+                snapshot = current
+
+    def empty(self) -> bool:
+        return len(self.load()[1]) == 0
+
+    # Writers hold the lock, returns the new data file
+    def rebase(self, origin: date) -> Path:
+        # Days before the first stored one shift every row, the only write that costs the whole history
+        _, old_path = self.snapshot()
+        old_origin, old = self.load()
+        shift = 0 if old_origin is None else (old_origin - origin).days
+        rows = np.full((shift + len(old), self.width), np.nan)
+        rows[shift:] = old
+        data_path = self.path.with_name(f"{self.path.name}.{origin.isoformat()}.f8")
+        atomic_write(data_path, rows.tobytes())
+        # Until the sidecar is replaced, readers and a crash leave the old rows with the old origin
+        atomic_write(self.meta_path, json.dumps({"origin": origin.isoformat(), "columns": self.columns,
+                                                 "data": data_path.name}))
+        # Also drop data files left by a crash before their sidecar was written
+        for stale in {old_path, *self.path.parent.glob(f"{self.path.name}.*.f8")} - {data_path}:
+            try:
+                stale.unlink(missing_ok=True)
+            except OSError:
+                # Still mapped by a reader on Windows, removed by a later rebase
+                pass
+        return data_path
+
+    def write(self, rows: Rows):
+        if not rows:
+            return
+        self.check_columns(rows)
+        with file_lock(self.lock_path):
+            self.write_locked(rows)
+
+    def write_locked(self, rows: Rows):
+        origin, data_path = self.snapshot()
+        if origin is None or min(rows) < origin:
+            origin = min(rows)
+            data_path = self.rebase(origin)
+
+        # Grow the file with empty rows up to the last day
+        current = self.length(data_path)
+        length = max(current, (max(rows) - origin).days + 1)
+        if length > current:
+            with open(data_path, "ab") as f:
+                np.full((length - current, self.width), np.nan).tofile(f)
+
+        array = np.memmap(data_path, dtype=np.float64, mode='r+', shape=(length, self.width))
+        for day, row in rows.items():
+            for column, value in row.items():
+                array[(day - origin).days, self.columns.index(column)] = value
+        array.flush()
+
+    def read(self, start: date, end: date) -> Rows:
+        origin, rows = self.load()
+        if origin is None or len(rows) == 0:
+            return {}
+        first = max((start - origin).days, 0)
+        last = min((end - origin).days + 1, len(rows))
+        if first >= last:
+            return {}
+        window = np.array(rows[first:last])
+        ret = {}
+        for offset in np.flatnonzero(~np.isnan(window).all(axis=1)):
+            day = date.fromordinal(origin.toordinal() + first + int(offset))
+            ret[day] = dict(zip(self.columns, window[offset].tolist()))
+        return ret
+
+
+class SqliteSeriesStore(SeriesStore):
+    """
+    One table row per day keyed by its ordinal, upserted in place.
+    """
+
+    def __init__(self, path: Union[str, Path], columns: Sequence[str]):
+        super().__init__(path, columns)
+        for column in self.columns:
+            if not column.isidentifier():
+                raise ValueError(f"Invalid column name {column}")
+        self.db_path = self.path.with_suffix(".sqlite3")
+
+    def connect(self) -> sqlite3.Connection:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        columns = ", ".join(f"{column} REAL" for column in self.columns)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS series (day INTEGER PRIMARY KEY, {columns})")
+        return conn
+
+    def write(self, rows: Rows):
+        self.check_columns(rows)
+        # Rows setting the same columns share one statement
+        groups: Dict[tuple, List[Iterable]] = {}
+        for day, row in rows.items():
+            keys = tuple(sorted(row))
+            groups.setdefault(keys, []).append([day.toordinal()] + [row[key] for key in keys])
+        # closing closes the connection, its own context commits the writes as one transaction
+        with closing(self.connect()) as conn:
+            with conn:
+                for keys, values in groups.items():
+                    updates = ", ".join(f"{key} = excluded.{key}" for key in keys)
+                    conn.executemany(
+                        f"INSERT INTO series (day, {', '.join(keys)}) VALUES ({', '.join('?' * (len(keys) + 1))}) "
+                        f"ON CONFLICT(day) DO UPDATE SET {updates}", values)
+
+    def read(self, start: date, end: date) -> Rows:
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(f"SELECT day, {', '.join(self.columns)} FROM series WHERE day BETWEEN ? AND ?",
+                                  (start.toordinal(), end.toordinal()))
+            return {date.fromordinal(day): {column: np.nan if value is None else value
+                                            for column, value in zip(self.columns, values)}
+                    for day, *values in cursor}
+
+    def empty(self) -> bool:
+        with closing(self.connect()) as conn:
+            return conn.execute("SELECT 1 FROM series LIMIT 1").fetchone() is None
+
+
+stores = {
+    'memmap': MemmapSeriesStore,
+    'sqlite': SqliteSeriesStore,
+}
+
+
+def open_store(kind: Optional[str], path: Union[str, Path], columns: Sequence[str]) -> SeriesStore:
+    return stores[kind or 'memmap'](path, columns)